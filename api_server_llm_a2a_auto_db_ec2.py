@@ -1,12 +1,34 @@
+import asyncio
+import json
+import logging
 import os
-import sqlite3
-from typing import Dict, Any, List, Optional
-
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-
+from typing import AsyncIterator, Dict, Any, List, Optional, Set, Tuple
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from freigent_db import (
+    NEXT_PROFILE_SEQ_SQL,
+    db_bulk_ingest,
+    db_connection,
+    db_index_profile_terms,
+    db_load_profiles,
+    db_rank_profiles,
+    init_db,
+    parse_bulk_records,
+    profile_term_weights,
+    term_weights,
+    text_terms,
+)
 from freigent_real_json import RealJsonFreigent
-from nanda_hub import hub  # NandaHub singleton (in-memory)
+from freigent_streaming import streaming_response, validate_stream_format
+from nanda_hub import A2AMessage, InboxFull, NandaHub, hub  # NandaHub singleton (NANDA_HUB_BACKEND)
+from nanda_workers import A2AWorkerPool
+from profile_index import PROFILE_INDEX
+
+logger = logging.getLogger(__name__)
 
 
 # ----------------------------------------------------------------------
@@ -19,69 +41,35 @@ app = FastAPI(
 
 # ----------------------------------------------------------------------
 # SQLite setup (profiles & agents persistence)
+# Schema lives in freigent_db.MIGRATIONS; init_db() applies pending ones.
 # ----------------------------------------------------------------------
-DB_PATH = os.getenv("FREIGENT_DB_PATH", "freigent.db")
-
-
-def init_db() -> None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Table for agents (Freigents)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS agents (
-            agent_id TEXT PRIMARY KEY,
-            agent_type TEXT NOT NULL,
-            display_name TEXT NOT NULL,
-            personality_summary TEXT DEFAULT ''
-        )
-        """
-    )
-
-    # Table for profiles (1:1 with user_id)
-    # IMPORTANT: use 'values_text' instead of SQL reserved word 'values'
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS profiles (
-            user_id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            personality TEXT NOT NULL,
-            values_text TEXT NOT NULL
-        )
-        """
-    )
+# Initialize DB at import time
+init_db()
 
-    # Table for product experiences (many per user)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS experiences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            notes TEXT NOT NULL,
-            rating INTEGER NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES profiles(user_id)
-        )
-        """
-    )
+# Profiles written per transaction by the bulk ingestion endpoint
+BULK_BATCH_SIZE = int(os.getenv("FREIGENT_BULK_BATCH_SIZE", "5000"))
 
-    conn.commit()
-    conn.close()
+# Default number of helper Freigents asked per auto_search
+MAX_HELPERS = int(os.getenv("FREIGENT_MAX_HELPERS", "5"))
 
+# Most helper Freigents a client may ask for (each one is an LLM call)
+MAX_HELPERS_LIMIT = int(os.getenv("FREIGENT_MAX_HELPERS_LIMIT", "20"))
 
-def get_db_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Upper bound for the ?timeout= of the long-poll inbox endpoint
+MAX_LONG_POLL_SECONDS = float(os.getenv("NANDA_MAX_LONG_POLL_SECONDS", "60"))
 
+# How long auto_search waits for each helper's A2A reply
+HELPER_TIMEOUT_SECONDS = float(os.getenv("FREIGENT_HELPER_TIMEOUT_SECONDS", "30"))
 
-# Initialize DB at import time
-init_db()
+# Every Freigent with a profile joins this consumer group on this topic, so
+# an auto_search with a topic (e.g. "recommendation_request:electronics")
+# is load-balanced round-robin over them instead of asking ranked helpers
+RECOMMENDATION_TOPIC = "recommendation_request"
+HELPER_GROUP = os.getenv("FREIGENT_HELPER_GROUP", "freigents")
 
 
 # ----------------------------------------------------------------------
-# In-memory cache of RealJsonFreigent objects (LLM client)
+# In-memory cache of RealJsonFreigent objects (share one pooled LLM client)
 # ----------------------------------------------------------------------
 FREIGENTS: Dict[str, RealJsonFreigent] = {}
 
@@ -101,26 +89,24 @@ def db_upsert_agent(
     display_name: str,
     personality_summary: str,
 ) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO agents (agent_id, agent_type, display_name, personality_summary)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(agent_id) DO UPDATE SET
-            agent_type = excluded.agent_type,
-            display_name = excluded.display_name,
-            personality_summary = excluded.personality_summary
-        """,
-        (agent_id, agent_type, display_name, personality_summary),
-    )
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO agents (agent_id, agent_type, display_name, personality_summary)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(agent_id) DO UPDATE SET
+                agent_type = excluded.agent_type,
+                display_name = excluded.display_name,
+                personality_summary = excluded.personality_summary
+            """,
+            (agent_id, agent_type, display_name, personality_summary),
+        )
 
 
-def db_upsert_profile(user_id: str, profile_dict: Dict[str, Any]) -> None:
+def db_upsert_profile(user_id: str, profile_dict: Dict[str, Any]) -> int:
     """
     Stores/updates the profile row and replaces all experiences.
+    Returns the profile's new updated_seq.
     profile_dict structure is:
     {
       "name": ...,
@@ -132,45 +118,51 @@ def db_upsert_profile(user_id: str, profile_dict: Dict[str, Any]) -> None:
       ]
     }
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # NOTE: use 'values_text' column in DB
-    cur.execute(
-        """
-        INSERT INTO profiles (user_id, name, personality, values_text)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            name = excluded.name,
-            personality = excluded.personality,
-            values_text = excluded.values_text
-        """,
-        (
-            user_id,
-            profile_dict.get("name", ""),
-            profile_dict.get("personality", ""),
-            profile_dict.get("values", ""),
-        ),
-    )
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # Replace experiences for this user
-    cur.execute("DELETE FROM experiences WHERE user_id = ?", (user_id,))
-    for exp in profile_dict.get("experiences", []):
+        # NOTE: use 'values_text' column in DB
         cur.execute(
-            """
-            INSERT INTO experiences (user_id, name, notes, rating)
-            VALUES (?, ?, ?, ?)
+            f"""
+            INSERT INTO profiles (user_id, name, personality, values_text, updated_seq)
+            VALUES (?, ?, ?, ?, {NEXT_PROFILE_SEQ_SQL})
+            ON CONFLICT(user_id) DO UPDATE SET
+                name = excluded.name,
+                personality = excluded.personality,
+                values_text = excluded.values_text,
+                updated_seq = excluded.updated_seq
             """,
             (
                 user_id,
-                exp.get("name", ""),
-                exp.get("notes", ""),
-                int(exp.get("rating", 0)),
+                profile_dict.get("name", ""),
+                profile_dict.get("personality", ""),
+                profile_dict.get("values", ""),
             ),
         )
 
-    conn.commit()
-    conn.close()
+        # Replace experiences for this user
+        cur.execute("DELETE FROM experiences WHERE user_id = ?", (user_id,))
+        for exp in profile_dict.get("experiences", []):
+            cur.execute(
+                """
+                INSERT INTO experiences (user_id, name, notes, rating)
+                VALUES (?, ?, ?, ?)
+                """,
+                (
+                    user_id,
+                    exp.get("name", ""),
+                    exp.get("notes", ""),
+                    int(exp.get("rating", 0)),
+                ),
+            )
+
+        # keep the helper-ranking term index in the same transaction
+        db_index_profile_terms(conn, [(user_id, profile_dict)])
+
+        row = cur.execute(
+            "SELECT updated_seq FROM profiles WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row["updated_seq"]
 
 
 def db_load_profile(user_id: str) -> Optional[Dict[str, Any]]:
@@ -178,31 +170,31 @@ def db_load_profile(user_id: str) -> Optional[Dict[str, Any]]:
     Loads profile + experiences for a given user_id.
     Returns None if no profile exists.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # NOTE: select values_text and map it back to 'values'
-    cur.execute(
-        "SELECT user_id, name, personality, values_text FROM profiles WHERE user_id = ?",
-        (user_id,),
-    )
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return None
-
-    profile = {
-        "name": row["name"],
-        "personality": row["personality"],
-        "values": row["values_text"],
-        "experiences": [],
-    }
+        # NOTE: select values_text and map it back to 'values'
+        cur.execute(
+            "SELECT user_id, name, personality, values_text FROM profiles WHERE user_id = ?",
+            (user_id,),
+        )
+        row = cur.fetchone()
+        if not row:
+            return None
+
+        profile = {
+            "name": row["name"],
+            "personality": row["personality"],
+            "values": row["values_text"],
+            "experiences": [],
+        }
+
+        cur.execute(
+            "SELECT name, notes, rating FROM experiences WHERE user_id = ?",
+            (user_id,),
+        )
+        exp_rows = cur.fetchall()
 
-    cur.execute(
-        "SELECT name, notes, rating FROM experiences WHERE user_id = ?",
-        (user_id,),
-    )
-    exp_rows = cur.fetchall()
     for e in exp_rows:
         profile["experiences"].append(
             {
@@ -212,35 +204,111 @@ def db_load_profile(user_id: str) -> Optional[Dict[str, Any]]:
             }
         )
 
-    conn.close()
     return profile
 
 
-def db_list_helper_agent_ids(base_user_id: str) -> List[str]:
+def db_list_helper_agent_ids(base_user_id: str, limit: Optional[int] = None) -> List[str]:
     """
     Returns a list of other freigent agent_ids that:
     - are type='freigent'
     - are not base_user_id
     - have a stored profile
+    At most `limit` ids (ordered by agent_id) if limit is given.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
+    sql = """
         SELECT a.agent_id
         FROM agents a
         JOIN profiles p ON a.agent_id = p.user_id
         WHERE a.agent_type = 'freigent'
           AND a.agent_id != ?
-        """,
-        (base_user_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+        ORDER BY a.agent_id
+    """
+    params: List[Any] = [base_user_id]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    with db_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
     return [r["agent_id"] for r in rows]
 
 
+def db_filter_agent_ids(agent_ids: List[str], agent_type: str) -> List[str]:
+    """Keep the ids registered in `agents` with agent_type, preserving order."""
+    if not agent_ids:
+        return []
+    placeholders = ", ".join("?" for _ in agent_ids)
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT agent_id FROM agents
+            WHERE agent_type = ? AND agent_id IN ({placeholders})
+            """,
+            [agent_type, *agent_ids],
+        ).fetchall()
+    found = {r["agent_id"] for r in rows}
+    return [aid for aid in agent_ids if aid in found]
+
+
+def db_select_helper_agent_ids(
+    base_user_id: str,
+    base_profile: Dict[str, Any],
+    query: str,
+    max_helpers: int,
+) -> List[str]:
+    """
+    Pick at most max_helpers helper Freigents, most relevant first.
+
+    Relevance is scored from the precomputed profile_terms index against
+    the query terms (weighted double) plus the requesting user's own
+    profile terms. If fewer than max_helpers share any term, the rest is
+    filled with the nearest profiles from PROFILE_INDEX, then from
+    db_list_helper_agent_ids.
+    """
+    if max_helpers <= 0:
+        return []
+
+    weighted: Dict[str, float] = {}
+    for term, weight in profile_term_weights(base_profile).items():
+        weighted[term] = weight
+    for term, weight in term_weights(text_terms(query)).items():
+        weighted[term] = weighted.get(term, 0.0) + 2.0 * weight
+
+    helper_ids = [
+        user_id
+        for user_id, _score in db_rank_profiles(
+            weighted,
+            limit=max_helpers,
+            agent_type="freigent",
+            exclude_user_id=base_user_id,
+        )
+    ]
+
+    # Too few term matches: fall back to the most similar profiles overall,
+    # then to plain agent_id order
+    if len(helper_ids) < max_helpers:
+        similar_ids = [
+            user_id
+            for user_id, _score in PROFILE_INDEX.similar(
+                base_profile,
+                k=4 * max_helpers,
+                exclude=[base_user_id, *helper_ids],
+                extra_text=query,
+            )
+        ]
+        helper_ids += db_filter_agent_ids(similar_ids, "freigent")[: max_helpers - len(helper_ids)]
+
+    if len(helper_ids) < max_helpers:
+        chosen = set(helper_ids)
+        for hid in db_list_helper_agent_ids(base_user_id, limit=max_helpers + len(helper_ids)):
+            if hid not in chosen:
+                helper_ids.append(hid)
+                if len(helper_ids) >= max_helpers:
+                    break
+
+    return helper_ids
+
+
 # ----------------------------------------------------------------------
 # Pydantic models for Freigent profile & search
 # ----------------------------------------------------------------------
@@ -257,8 +325,36 @@ class UserProfileModel(BaseModel):
     experiences: List[ExperienceModel] = []
 
 
+class BulkProfileRecord(BaseModel):
+    user_id: str
+    profile: UserProfileModel
+
+
+class BulkRecordStatus(BaseModel):
+    index: int
+    user_id: Optional[str] = None
+    status: str  # "ok" or "error"
+    error: Optional[str] = None
+
+
+class BulkUpsertResponse(BaseModel):
+    total: int
+    num_ok: int
+    num_errors: int
+    results: List[BulkRecordStatus]
+
+
 class SearchRequest(BaseModel):
     query: str
+    use_cache: bool = True  # set False to force fresh LLM calls
+
+
+class AutoSearchRequest(SearchRequest):
+    # only the most relevant helpers are asked (see db_select_helper_agent_ids)
+    max_helpers: int = Field(default=MAX_HELPERS, ge=0, le=MAX_HELPERS_LIMIT)
+    # publish the requests to this recommendation_request topic instead: the
+    # helper group hands each one to the next Freigent in turn
+    topic: Optional[str] = None
 
 
 class SearchResponse(BaseModel):
@@ -287,6 +383,31 @@ class A2ASendRequest(BaseModel):
     from_agent_id: str
     to_agent_id: str
     payload: Dict[str, Any]
+    ttl_seconds: Optional[float] = Field(default=None, gt=0)  # default: hub's TTL
+
+
+class A2ASendBatchRequest(BaseModel):
+    from_agent_id: str
+    to_agent_ids: List[str] = Field(..., min_items=1)
+    payload: Dict[str, Any]
+    ttl_seconds: Optional[float] = Field(default=None, gt=0)  # default: hub's TTL
+
+
+class A2ASubscribeRequest(BaseModel):
+    agent_id: str
+    group: Optional[str] = None  # consumer group: one member gets each message
+
+
+class A2APublishRequest(BaseModel):
+    from_agent_id: str
+    payload: Dict[str, Any]
+    ttl_seconds: Optional[float] = Field(default=None, gt=0)  # default: hub's TTL
+
+
+class A2AAckRequest(BaseModel):
+    message_ids: List[str]
+    lease_token: str  # from the taken messages: a lease that ran out no longer acks
+    requeue: bool = False  # True = nack: redeliver now instead of finishing
 
 
 class A2AMessageModel(BaseModel):
@@ -294,6 +415,8 @@ class A2AMessageModel(BaseModel):
     from_agent_id: str
     to_agent_id: str
     payload: Dict[str, Any]
+    expires_at: Optional[float] = None
+    lease_token: Optional[str] = None  # set when taken with lease_seconds
 
 
 # ----------------------------------------------------------------------
@@ -314,100 +437,161 @@ class AutoSearchResponse(BaseModel):
 
 
 # ----------------------------------------------------------------------
-# Worker-style processing for one agent (reads from hub, uses DB profiles)
+# A2A workers: answer recommendation_request messages in the background
 # ----------------------------------------------------------------------
-def process_recommendation_requests_for_agent(
+async def handle_recommendation_requests(
     worker_id: str,
-    max_messages: int = 10,
+    msgs: List[A2AMessage],
+    profiles: Optional[Dict[str, Dict[str, Any]]] = None,
 ) -> List[Dict[str, Any]]:
     """
-    Internal helper (non-HTTP) that processes A2A messages for one agent.
+    Process a batch of A2A messages taken from worker_id's inbox.
 
-    - Reads messages from worker_id's inbox.
     - For each message with payload.type == 'recommendation_request':
         * Uses the profile from DB (payload.from_user_id or from_agent_id).
-        * Calls RealJsonFreigent.generate_recommendations_json(...)
-        * Sends back 'recommendation_response' to the requester.
+        * Awaits RealJsonFreigent.agenerate_recommendations_json(...)
+        * Sends back 'recommendation_response' (or 'recommendation_error')
+          to the requester, with original_message_id set.
+    - Messages are processed concurrently.
     - Returns a list of processed-message summaries.
+
+    `profiles` may carry already-loaded profiles by user_id; any other
+    profile the batch needs is fetched with a single db_load_profiles call.
     """
     freigent = get_or_create_freigent(worker_id)
-    msgs = hub.get_inbox(worker_id, clear=True)
-    processed: List[Dict[str, Any]] = []
 
-    for m in msgs[:max_messages]:
+    # Load every requester profile for this batch at once
+    profiles = dict(profiles or {})
+    wanted = {
+        (m.payload or {}).get("from_user_id", m.from_agent_id)
+        for m in msgs
+        if (m.payload or {}).get("type") == "recommendation_request"
+    }
+    profiles.update(await run_in_threadpool(db_load_profiles, wanted - profiles.keys()))
+
+    async def reply(m: A2AMessage, payload: Dict[str, Any]) -> None:
+        try:
+            # never block the event loop: on a full requester inbox, nor
+            # on a durable hub's commit
+            await hub.asend_message(
+                from_agent_id=worker_id,
+                to_agent_id=m.from_agent_id,
+                payload=payload,
+            )
+        except InboxFull as e:
+            logger.warning("Dropping reply to %s: %s", m.message_id, e)
+
+    async def send_error(m: A2AMessage, error_text: str) -> Dict[str, Any]:
+        await reply(
+            m,
+            {
+                "type": "recommendation_error",
+                "reason": error_text,
+                "original_message_id": m.message_id,
+            },
+        )
+        return {
+            "request_message_id": m.message_id,
+            "status": "error",
+            "error": error_text,
+        }
+
+    async def handle(m: A2AMessage) -> Dict[str, Any]:
         payload = m.payload or {}
         msg_type = payload.get("type")
 
         if msg_type != "recommendation_request":
-            processed.append(
-                {
-                    "request_message_id": m.message_id,
-                    "status": "ignored",
-                    "reason": f"Unsupported payload.type '{msg_type}'",
-                }
-            )
-            continue
+            return {
+                "request_message_id": m.message_id,
+                "status": "ignored",
+                "reason": f"Unsupported payload.type '{msg_type}'",
+            }
 
         from_agent = m.from_agent_id
         query = payload.get("query", "")
         profile_user_id = payload.get("from_user_id", from_agent)
 
-        profile = db_load_profile(profile_user_id)
+        profile = profiles.get(profile_user_id)
         if not profile:
-            error_text = f"No profile found for user_id '{profile_user_id}'"
-            hub.send_message(
-                from_agent_id=worker_id,
-                to_agent_id=from_agent,
-                payload={
-                    "type": "recommendation_error",
-                    "reason": error_text,
-                    "original_message_id": m.message_id,
-                },
-            )
-            processed.append(
-                {
-                    "request_message_id": m.message_id,
-                    "status": "error",
-                    "error": error_text,
-                }
+            return await send_error(m, f"No profile found for user_id '{profile_user_id}'")
+
+        try:
+            result = await freigent.agenerate_recommendations_json(
+                user_profile=profile,
+                query=query,
+                use_cache=bool(payload.get("use_cache", True)),
             )
-            continue
+        except Exception as e:
+            return await send_error(m, f"Recommendation failed: {e}")
 
-        result = freigent.generate_recommendations_json(
-            user_profile=profile,
-            query=query,
+        await reply(
+            m,
+            {
+                "type": "recommendation_response",
+                "original_message_id": m.message_id,
+                "query": query,
+                "profile_user_id": profile_user_id,
+                "result": result,
+            },
         )
-
-        reply_payload = {
-            "type": "recommendation_response",
-            "original_message_id": m.message_id,
-            "query": query,
-            "profile_user_id": profile_user_id,
-            "result": result,
+        return {
+            "request_message_id": m.message_id,
+            "status": "ok",
+            "sent_to": from_agent,
         }
 
-        hub.send_message(
-            from_agent_id=worker_id,
-            to_agent_id=from_agent,
-            payload=reply_payload,
-        )
+    return list(await asyncio.gather(*(handle(m) for m in msgs)))
+
+
+A2A_WORKERS = A2AWorkerPool(
+    hub,
+    handle_recommendation_requests,
+    num_workers=int(os.getenv("NANDA_NUM_WORKERS", "8")),
+    batch_size=int(os.getenv("NANDA_WORKER_BATCH_SIZE", "10")),
+    # a durable hub is shared with other workers: sweep it for their messages
+    poll_interval=hub.poll_interval,
+)
+
+
+@app.on_event("startup")
+async def start_a2a_workers() -> None:
+    await A2A_WORKERS.start()
+
+
+@app.on_event("shutdown")
+async def stop_a2a_workers() -> None:
+    await A2A_WORKERS.stop()
 
-        processed.append(
-            {
-                "request_message_id": m.message_id,
-                "status": "ok",
-                "sent_to": from_agent,
-            }
-        )
 
-    return processed
+@app.on_event("startup")
+async def join_helper_group() -> None:
+    # only the in-process hub forgets its subscriptions on restart
+    if type(hub) is not NandaHub:
+        return
+
+    def subscribe_all() -> None:
+        for agent_id in db_list_helper_agent_ids(""):
+            hub.subscribe(agent_id, RECOMMENDATION_TOPIC, group=HELPER_GROUP)
+
+    await run_in_threadpool(subscribe_all)
+
+
+@app.on_event("startup")
+def start_profile_index() -> None:
+    # load the similarity index in the background, not in the first request
+    PROFILE_INDEX.start()
+
+
+@app.on_event("shutdown")
+def stop_profile_index() -> None:
+    PROFILE_INDEX.stop()
 
 
 # ----------------------------------------------------------------------
 # Health
 # ----------------------------------------------------------------------
 @app.get("/health")
-def health_check() -> Dict[str, str]:
+async def health_check() -> Dict[str, str]:
     return {"status": "ok"}
 
 
@@ -418,7 +602,7 @@ def health_check() -> Dict[str, str]:
     "/freigent/{user_id}/profile",
     summary="Set or update the user profile for this Freigent (stored in SQLite)",
 )
-def freigent_set_profile(user_id: str, profile: UserProfileModel) -> Dict[str, Any]:
+async def freigent_set_profile(user_id: str, profile: UserProfileModel) -> Dict[str, Any]:
     """
     Stores the user's profile in SQLite DB. This profile will be used
     later when calling /freigent/{user_id}/search or /auto_search.
@@ -440,27 +624,91 @@ def freigent_set_profile(user_id: str, profile: UserProfileModel) -> Dict[str, A
         ],
     }
 
-    # Save to DB
-    db_upsert_profile(user_id, profile_dict)
+    def write() -> None:
+        # Save to DB (and the similarity index)
+        seq = db_upsert_profile(user_id, profile_dict)
+        PROFILE_INDEX.upsert(user_id, profile_dict, seq=seq)
+
+        # Register agent in DB and NandaHub
+        db_upsert_agent(
+            agent_id=user_id,
+            agent_type="freigent",
+            display_name=profile.name,
+            personality_summary=profile.personality,
+        )
+        hub.register_agent(
+            agent_id=user_id,
+            agent_type="freigent",
+            display_name=profile.name,
+            personality_summary=profile.personality,
+        )
+        # take a share of the recommendation requests published to the topic
+        hub.subscribe(user_id, RECOMMENDATION_TOPIC, group=HELPER_GROUP)
+
+    # sqlite writes block; keep them off the event loop
+    await run_in_threadpool(write)
 
     # Ensure LLM client exists
     get_or_create_freigent(user_id)
 
-    # Register agent in DB and NandaHub
-    db_upsert_agent(
-        agent_id=user_id,
-        agent_type="freigent",
-        display_name=profile.name,
-        personality_summary=profile.personality,
-    )
-    hub.register_agent(
-        agent_id=user_id,
-        agent_type="freigent",
-        display_name=profile.name,
-        personality_summary=profile.personality,
+    return {"status": "ok", "user_id": user_id}
+
+
+@app.post(
+    "/freigent/profiles/bulk",
+    response_model=BulkUpsertResponse,
+    summary="Create or update many Freigent profiles at once (NDJSON or JSON array)",
+)
+async def freigent_bulk_set_profiles(request: Request) -> BulkUpsertResponse:
+    """
+    Bulk version of POST /freigent/{user_id}/profile for onboarding.
+
+    Body: NDJSON (one {"user_id": ..., "profile": {...}} object per line)
+    or a JSON array of such objects. Records are validated one by one and
+    written FREIGENT_BULK_BATCH_SIZE at a time with executemany, each batch
+    in a single transaction that also upserts the agents rows. Successfully
+    written users are registered in NandaHub. Every record gets a status.
+    """
+    try:
+        records = parse_bulk_records(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    profiles_by_id: Dict[str, UserProfileModel] = {}
+
+    def to_item(record: Any) -> Tuple[str, Dict[str, Any]]:
+        rec = BulkProfileRecord.parse_obj(record)
+        profiles_by_id[rec.user_id] = rec.profile
+        return rec.user_id, rec.profile.dict()
+
+    # Large uploads take a while to write; keep the event loop free
+    results = await run_in_threadpool(
+        db_bulk_ingest, records, to_item, BULK_BATCH_SIZE, "freigent"
     )
 
-    return {"status": "ok", "user_id": user_id}
+    written = [r["user_id"] for r in results if r["status"] == "ok"]
+
+    def register_written() -> None:
+        for user_id in written:
+            profile = profiles_by_id[user_id]
+            hub.register_agent(
+                agent_id=user_id,
+                agent_type="freigent",
+                display_name=profile.name,
+                personality_summary=profile.personality,
+            )
+            hub.subscribe(user_id, RECOMMENDATION_TOPIC, group=HELPER_GROUP)
+
+    # a hub round-trip or two per user (SQL writes with the durable hub)
+    await run_in_threadpool(register_written)
+
+    num_ok = len(written)
+    return BulkUpsertResponse(
+        total=len(results),
+        num_ok=num_ok,
+        num_errors=len(results) - num_ok,
+        results=results,
+    )
 
 
 @app.post(
@@ -468,25 +716,18 @@ def freigent_set_profile(user_id: str, profile: UserProfileModel) -> Dict[str, A
     response_model=SearchResponse,
     summary="Get product recommendations using the stored profile + query (single agent, DB-backed)",
 )
-def freigent_search(user_id: str, req: SearchRequest) -> Dict[str, Any]:
+async def freigent_search(user_id: str, req: SearchRequest) -> Dict[str, Any]:
     """
     Uses the stored user profile from DB + the search query to ask the LLM
     (via RealJsonFreigent) for structured JSON recommendations.
     """
-    profile = db_load_profile(user_id)
-    if not profile:
-        raise HTTPException(
-            status_code=400,
-            detail=(
-                f"No profile stored for user_id '{user_id}'. "
-                f"Call POST /freigent/{user_id}/profile first."
-            ),
-        )
+    profile = await run_in_threadpool(_load_profile_or_400, user_id)
 
     freigent = get_or_create_freigent(user_id)
-    result = freigent.generate_recommendations_json(
+    result = await freigent.agenerate_recommendations_json(
         user_profile=profile,
         query=req.query,
+        use_cache=req.use_cache,
     )
     return result
 
@@ -499,8 +740,10 @@ def freigent_search(user_id: str, req: SearchRequest) -> Dict[str, Any]:
     response_model=AgentRegisterResponse,
     summary="Register an agent in NandaHub (does NOT affect DB)",
 )
-def nanda_register_agent(req: AgentRegisterRequest) -> Dict[str, Any]:
-    reg = hub.register_agent(
+async def nanda_register_agent(req: AgentRegisterRequest) -> Dict[str, Any]:
+    # DurableNandaHub / RemoteNandaHub do I/O here: keep it off the event loop
+    reg = await run_in_threadpool(
+        hub.register_agent,
         agent_id=req.agent_id,
         agent_type=req.agent_type,
         display_name=req.display_name,
@@ -518,8 +761,8 @@ def nanda_register_agent(req: AgentRegisterRequest) -> Dict[str, Any]:
     "/nanda/agents",
     summary="List all registered agents in NandaHub (in-memory)",
 )
-def nanda_list_agents() -> List[Dict[str, Any]]:
-    agents = hub.list_agents()
+async def nanda_list_agents() -> List[Dict[str, Any]]:
+    agents = await run_in_threadpool(hub.list_agents)
     return [
         {
             "agent_id": a.agent_id,
@@ -536,33 +779,186 @@ def nanda_list_agents() -> List[Dict[str, Any]]:
     response_model=A2AMessageModel,
     summary="Send an A2A message via NandaHub",
 )
-def nanda_a2a_send(req: A2ASendRequest) -> Dict[str, Any]:
-    msg = hub.send_message(
+async def nanda_a2a_send(req: A2ASendRequest) -> Dict[str, Any]:
+    """
+    Returns 429 (with Retry-After) when the recipient's inbox is full, so
+    callers can shed load. Runs in the threadpool because the "block"
+    overflow policy may wait for room.
+    """
+    try:
+        msg = await run_in_threadpool(
+            hub.send_message,
+            from_agent_id=req.from_agent_id,
+            to_agent_id=req.to_agent_id,
+            payload=req.payload,
+            ttl=req.ttl_seconds,
+        )
+    except InboxFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    return _messages_to_dicts([msg])[0]
+
+
+class A2ASendBatchResponse(BaseModel):
+    messages: List[A2AMessageModel]
+    rejected_agent_ids: List[str]  # recipients whose inbox was full
+
+
+@app.post(
+    "/nanda/a2a/send_batch",
+    response_model=A2ASendBatchResponse,
+    summary="Send one A2A payload to many agents via NandaHub (multicast)",
+)
+async def nanda_a2a_send_batch(req: A2ASendBatchRequest) -> Dict[str, Any]:
+    """
+    One hub.send_many call for all recipients. Full inboxes don't fail the
+    batch: those recipients are listed in rejected_agent_ids.
+    """
+    msgs = await run_in_threadpool(
+        hub.send_many,
         from_agent_id=req.from_agent_id,
-        to_agent_id=req.to_agent_id,
+        to_agent_ids=req.to_agent_ids,
         payload=req.payload,
+        ttl=req.ttl_seconds,
     )
+    delivered = {m.to_agent_id for m in msgs}
     return {
-        "message_id": msg.message_id,
-        "from_agent_id": msg.from_agent_id,
-        "to_agent_id": msg.to_agent_id,
-        "payload": msg.payload,
+        "messages": _messages_to_dicts(msgs),
+        "rejected_agent_ids": [a for a in req.to_agent_ids if a not in delivered],
     }
 
 
+@app.post(
+    "/nanda/a2a/topics/{topic}/subscribe",
+    summary="Subscribe an agent to a topic (and its ':' sub-topics), optionally in a consumer group",
+)
+async def nanda_a2a_subscribe(topic: str, req: A2ASubscribeRequest) -> Dict[str, Any]:
+    try:
+        await run_in_threadpool(hub.subscribe, req.agent_id, topic, group=req.group)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "topic": topic, "agent_id": req.agent_id, "group": req.group}
+
+
+@app.post(
+    "/nanda/a2a/topics/{topic}/unsubscribe",
+    summary="Remove a topic subscription",
+)
+async def nanda_a2a_unsubscribe(topic: str, req: A2ASubscribeRequest) -> Dict[str, Any]:
+    removed = await run_in_threadpool(hub.unsubscribe, req.agent_id, topic, group=req.group)
+    return {"status": "ok", "removed": removed}
+
+
+@app.get(
+    "/nanda/a2a/topics",
+    summary="List topic subscriptions (all topics, or one)",
+)
+async def nanda_a2a_subscriptions(
+    topic: Optional[str] = Query(None, description="Only this exact topic"),
+) -> List[Dict[str, Any]]:
+    return await run_in_threadpool(hub.subscriptions, topic)
+
+
+@app.post(
+    "/nanda/a2a/topics/{topic}/publish",
+    response_model=List[A2AMessageModel],
+    summary="Publish to a topic: a copy per subscriber, one per consumer group",
+)
+async def nanda_a2a_publish(topic: str, req: A2APublishRequest) -> List[Dict[str, Any]]:
+    """
+    Returns the delivered messages; [] if nobody is subscribed. Runs in
+    the threadpool because "block" inboxes may wait for room.
+    """
+    try:
+        msgs = await run_in_threadpool(
+            hub.publish,
+            from_agent_id=req.from_agent_id,
+            topic=topic,
+            payload=req.payload,
+            ttl=req.ttl_seconds,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _messages_to_dicts(msgs)
+
+
+@app.get(
+    "/nanda/a2a/inbox/{agent_id}/stats",
+    summary="Inbox size, capacity, overflow policy and rejected/dropped/expired counters",
+)
+async def nanda_a2a_inbox_stats(agent_id: str) -> Dict[str, Any]:
+    return await run_in_threadpool(hub.inbox_stats, agent_id)
+
+
 @app.get(
     "/nanda/a2a/inbox/{agent_id}",
     response_model=List[A2AMessageModel],
     summary="Get and clear the inbox of an agent",
 )
-def nanda_a2a_inbox(agent_id: str) -> List[Dict[str, Any]]:
-    msgs = hub.get_inbox(agent_id, clear=True)
+async def nanda_a2a_inbox(
+    agent_id: str,
+    max_messages: Optional[int] = Query(
+        None, ge=1, description="Take at most this many (oldest first); the rest stay queued"
+    ),
+    lease_seconds: Optional[float] = Query(
+        None, gt=0, description="Lease instead of remove: redelivered unless acked in time"
+    ),
+) -> List[Dict[str, Any]]:
+    msgs = await run_in_threadpool(
+        hub.take, agent_id, max_messages=max_messages, lease=lease_seconds
+    )
+    return _messages_to_dicts(msgs)
+
+
+@app.get(
+    "/nanda/a2a/inbox/{agent_id}/wait",
+    response_model=List[A2AMessageModel],
+    summary="Long-poll: wait for messages, then get and clear the inbox",
+)
+async def nanda_a2a_inbox_wait(
+    agent_id: str,
+    timeout: float = Query(
+        25.0, ge=0, le=MAX_LONG_POLL_SECONDS, description="Seconds to wait for a message"
+    ),
+    payload_type: Optional[str] = Query(None, description="Only take messages of this payload.type"),
+    max_messages: Optional[int] = Query(None, ge=1),
+    lease_seconds: Optional[float] = Query(None, gt=0),
+) -> List[Dict[str, Any]]:
+    """
+    Returns as soon as the inbox has a message (woken by send_message, no
+    polling), or an empty list after `timeout` seconds. max_messages and
+    lease_seconds work as for GET /nanda/a2a/inbox/{agent_id}.
+    """
+    msgs = await hub.areceive(
+        agent_id,
+        timeout=timeout,
+        payload_type=payload_type,
+        max_messages=max_messages,
+        lease=lease_seconds,
+    )
+    return _messages_to_dicts(msgs)
+
+
+@app.post(
+    "/nanda/a2a/inbox/{agent_id}/ack",
+    summary="Acknowledge (or give back) messages taken with lease_seconds",
+)
+async def nanda_a2a_inbox_ack(agent_id: str, req: A2AAckRequest) -> Dict[str, Any]:
+    if req.requeue:
+        requeued = await run_in_threadpool(hub.nack, agent_id, req.message_ids, req.lease_token)
+        return {"status": "ok", "requeued": requeued}
+    acked = await run_in_threadpool(hub.ack, agent_id, req.message_ids, req.lease_token)
+    return {"status": "ok", "acked": acked}
+
+
+def _messages_to_dicts(msgs: List[A2AMessage]) -> List[Dict[str, Any]]:
     return [
         {
             "message_id": m.message_id,
             "from_agent_id": m.from_agent_id,
             "to_agent_id": m.to_agent_id,
-            "payload": m.payload,
+            "payload": dict(m.payload),
+            "expires_at": m.expires_at,
+            "lease_token": m.lease_token,
         }
         for m in msgs
     ]
@@ -571,26 +967,7 @@ def nanda_a2a_inbox(agent_id: str) -> List[Dict[str, Any]]:
 # ----------------------------------------------------------------------
 # AUTO multi-agent endpoint (DB-backed profiles)
 # ----------------------------------------------------------------------
-@app.post(
-    "/freigent/{user_id}/auto_search",
-    response_model=AutoSearchResponse,
-    summary=(
-        "Automatic multi-agent search: base Freigent + helper Freigents via NandaHub A2A (profiles in SQLite)"
-    ),
-)
-def freigent_auto_search(user_id: str, req: SearchRequest) -> AutoSearchResponse:
-    """
-    End-to-end flow:
-
-    1. Use RealJsonFreigent for the base user_id to get a first recommendation
-       using the profile from DB.
-    2. Find helper Freigent agents from DB (other users with profiles).
-    3. For each helper:
-       - Send them an A2A recommendation_request.
-       - Process their inbox using process_recommendation_requests_for_agent.
-    4. Read the responses from the origin agent's inbox.
-    5. Merge products and return a combined JSON response.
-    """
+def _load_profile_or_400(user_id: str) -> Dict[str, Any]:
     profile = db_load_profile(user_id)
     if not profile:
         raise HTTPException(
@@ -600,74 +977,168 @@ def freigent_auto_search(user_id: str, req: SearchRequest) -> AutoSearchResponse
                 f"Call POST /freigent/{user_id}/profile first."
             ),
         )
+    return profile
 
-    base_freigent = get_or_create_freigent(user_id)
 
-    # 1) Base recommendation
-    base_result = base_freigent.generate_recommendations_json(
-        user_profile=profile,
-        query=req.query,
-    )
+async def _send_helper_requests(
+    user_id: str, profile: Dict[str, Any], req: AutoSearchRequest
+) -> Tuple[List[str], List["asyncio.Task[A2AMessage]"]]:
+    """
+    Pick the req.max_helpers most relevant helper Freigents, make sure they
+    are registered in NandaHub and send each of them an A2A
+    recommendation_request with hub.asend_request (answered by the worker
+    pool). With req.topic, publish up to req.max_helpers requests to that
+    topic instead and let the helper group pick who answers.
+
+    Returns (helper_ids, reply_tasks); reply_tasks[i] resolves to helper i's
+    correlated reply message (recommendation_response or
+    recommendation_error), or fails with asyncio.TimeoutError / InboxFull.
+    """
+    payload = {
+        "type": "recommendation_request",
+        "from_user_id": user_id,
+        "query": req.query,
+        "use_cache": req.use_cache,
+    }
+    if req.topic is not None:
+        return await _publish_helper_requests(user_id, req, payload)
+
+    def select_helpers() -> List[str]:
+        helper_ids = db_select_helper_agent_ids(user_id, profile, req.query, req.max_helpers)
+
+        # Also ensure they are registered in NandaHub (for inboxes)
+        helper_profiles = db_load_profiles(helper_ids)
+        for hid in helper_ids:
+            prof = helper_profiles.get(hid)
+            if prof:
+                hub.register_agent(
+                    agent_id=hid,
+                    agent_type="freigent",
+                    display_name=prof["name"],
+                    personality_summary=prof["personality"],
+                )
+        return helper_ids
+
+    # ranking and registration hit sqlite: run them off the event loop
+    helper_ids: List[str] = await run_in_threadpool(select_helpers)
+
+    async def ask(helper_id: str) -> A2AMessage:
+        # inside the task, so a full inbox only fails this helper
+        reply = await hub.asend_request(
+            from_agent_id=user_id,
+            to_agent_id=helper_id,
+            payload=payload,
+            timeout=HELPER_TIMEOUT_SECONDS,
+        )
+        return await reply
 
-    # 2) Helper agents from DB
-    helper_ids: List[str] = db_list_helper_agent_ids(user_id)
+    reply_tasks = [asyncio.ensure_future(ask(helper_id)) for helper_id in helper_ids]
 
-    # Also ensure they are registered in NandaHub (for inboxes)
-    for hid in helper_ids:
-        prof = db_load_profile(hid)
-        if prof:
-            hub.register_agent(
-                agent_id=hid,
-                agent_type="freigent",
-                display_name=prof["name"],
-                personality_summary=prof["personality"],
-            )
+    return helper_ids, reply_tasks
 
-    # 3) Send A2A recommendation_request messages to helpers
-    for helper_id in helper_ids:
-        hub.send_message(
-            from_agent_id=user_id,
-            to_agent_id=helper_id,
-            payload={
-                "type": "recommendation_request",
-                "from_user_id": user_id,
-                "query": req.query,
-            },
+
+def _check_helper_topic(req: AutoSearchRequest) -> None:
+    topic = req.topic
+    if topic is None:
+        return
+    if topic != RECOMMENDATION_TOPIC and not topic.startswith(RECOMMENDATION_TOPIC + ":"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"topic must be '{RECOMMENDATION_TOPIC}' or one of its ':' sub-topics",
         )
 
-    # 4) Simulate worker processing for each helper
-    for helper_id in helper_ids:
-        process_recommendation_requests_for_agent(helper_id, max_messages=10)
 
-    # 5) Read responses from the origin agent's inbox
-    incoming = hub.get_inbox(user_id, clear=True)
-    helper_results: List[HelperResult] = []
-    merged_products: List[Dict[str, Any]] = []
+async def _publish_helper_requests(
+    user_id: str, req: AutoSearchRequest, payload: Dict[str, Any]
+) -> Tuple[List[str], List["asyncio.Task[A2AMessage]"]]:
+    """The req.topic branch of _send_helper_requests."""
+    _check_helper_topic(req)
+    topic = req.topic or ""
 
-    # Start with base products
-    base_products = base_result.get("products", [])
-    if isinstance(base_products, list):
-        merged_products.extend(base_products)
+    def publish() -> List[Any]:
+        # the requester may be a member itself; publish skips it
+        members = {
+            s["agent_id"]
+            for s in hub.subscriptions(RECOMMENDATION_TOPIC)
+            if s["group"] == HELPER_GROUP
+        }
+        members.discard(user_id)
+        futures: List[Any] = []
+        asked: Set[str] = set()
+        for _ in range(min(req.max_helpers, len(members))):
+            # one publish = one request to the group's next member
+            got = hub.publish_request(
+                user_id, topic, payload, timeout=HELPER_TIMEOUT_SECONDS, block_timeout=0
+            )
+            futures += got
+            if not got or any(f.request.to_agent_id in asked for f in got):
+                break  # nobody left who hasn't been asked
+            asked.update(f.request.to_agent_id for f in got)
+        return futures
+
+    try:
+        futures = await run_in_threadpool(publish)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    for msg in incoming:
+    async def wait(fut: Any) -> A2AMessage:
+        return await fut
+
+    helper_ids = [f.request.to_agent_id for f in futures]
+    return helper_ids, [asyncio.ensure_future(wait(f)) for f in futures]
+
+
+def _helper_results_from(msgs: List[Any]) -> List[HelperResult]:
+    """Keep only the recommendation_response messages, as HelperResults."""
+    helper_results: List[HelperResult] = []
+    for msg in msgs:
         payload = msg.payload or {}
         p_type = payload.get("type")
         if p_type != "recommendation_response":
             continue
 
-        from_agent = msg.from_agent_id
-        result = payload.get("result", {})
-
         helper_results.append(
             HelperResult(
-                agent_id=from_agent,
-                result=result,
+                agent_id=msg.from_agent_id,
+                result=payload.get("result", {}),
             )
         )
+    return helper_results
 
-        products = result.get("products", [])
-        if isinstance(products, list):
-            merged_products.extend(products)
+
+def _product_key(product: Any) -> str:
+    """Identity of a recommended product: its name, else the whole item."""
+    if isinstance(product, dict):
+        name = product.get("name")
+        if isinstance(name, str) and name.strip():
+            return " ".join(name.lower().split())
+    return json.dumps(product, sort_keys=True, default=str)
+
+
+def _merge_auto_search(
+    user_id: str,
+    helper_ids: List[str],
+    base_result: Dict[str, Any],
+    helper_results: List[HelperResult],
+) -> AutoSearchResponse:
+    merged_products: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+
+    def add(products: Any) -> None:
+        # helpers may answer with the very result the base call got (same
+        # profile + query hit the same cache entry): keep each product once
+        if not isinstance(products, list):
+            return
+        for product in products:
+            key = _product_key(product)
+            if key not in seen:
+                seen.add(key)
+                merged_products.append(product)
+
+    # Start with base products
+    add(base_result.get("products", []))
+    for hr in helper_results:
+        add(hr.result.get("products", []))
 
     helper_count = len(helper_results)
     merged_summary = (
@@ -683,3 +1154,135 @@ def freigent_auto_search(user_id: str, req: SearchRequest) -> AutoSearchResponse
         merged_products=merged_products,
         merged_summary_for_user=merged_summary,
     )
+
+
+@app.post(
+    "/freigent/{user_id}/auto_search",
+    response_model=AutoSearchResponse,
+    summary=(
+        "Automatic multi-agent search: base Freigent + helper Freigents via NandaHub A2A (profiles in SQLite)"
+    ),
+)
+async def freigent_auto_search(user_id: str, req: AutoSearchRequest) -> AutoSearchResponse:
+    """
+    End-to-end flow:
+
+    1. Use RealJsonFreigent for the base user_id to get a first recommendation
+       using the profile from DB.
+    2. Pick up to req.max_helpers helper Freigent agents from DB, ranked by
+       relevance to the query and the user's profile.
+    3. Send each helper an A2A recommendation_request; the background A2A
+       workers answer them in parallel (and in parallel with step 1).
+    4. Collect the correlated replies (helpers that time out are skipped).
+    5. Merge products and return a combined JSON response.
+    """
+    profile = await run_in_threadpool(_load_profile_or_400, user_id)
+    base_freigent = get_or_create_freigent(user_id)
+
+    # 1) Base recommendation
+    base_task = asyncio.ensure_future(
+        base_freigent.agenerate_recommendations_json(
+            user_profile=profile,
+            query=req.query,
+            use_cache=req.use_cache,
+        )
+    )
+
+    reply_tasks: List["asyncio.Task[A2AMessage]"] = []
+    try:
+        # 2) + 3) Helper agents from DB, sent A2A recommendation_request messages
+        helper_ids, reply_tasks = await _send_helper_requests(user_id, profile, req)
+
+        # 4) Wait for the base result and every helper reply
+        base_result = await base_task
+        replies = await asyncio.gather(*reply_tasks, return_exceptions=True)
+    finally:
+        for task in [base_task, *reply_tasks]:
+            task.cancel()
+
+    # 5) Merge
+    return _merge_auto_search(
+        user_id,
+        helper_ids,
+        base_result,
+        _helper_results_from([r for r in replies if isinstance(r, A2AMessage)]),
+    )
+
+
+@app.post(
+    "/freigent/{user_id}/auto_search/stream",
+    summary="Streaming auto_search: one event per agent as soon as it answers, then the merged result",
+)
+async def freigent_auto_search_stream(
+    user_id: str,
+    req: AutoSearchRequest,
+    fmt: str = Query("sse", alias="format", description="'sse' (text/event-stream) or 'ndjson'"),
+) -> StreamingResponse:
+    """
+    Streaming variant of /freigent/{user_id}/auto_search. The base call and
+    every helper request run concurrently.
+
+    Events, in order:
+    - "agent_result" as soon as each agent answers (fastest first):
+      {"agent_id", "role": "base" | "helper", "result": {...}}
+    - "summary" when everyone is done: the AutoSearchResponse that
+      /freigent/{user_id}/auto_search would return.
+    """
+    validate_stream_format(fmt)
+    _check_helper_topic(req)
+    profile = await run_in_threadpool(_load_profile_or_400, user_id)
+    base_freigent = get_or_create_freigent(user_id)
+
+    async def events() -> AsyncIterator[Tuple[str, Any]]:
+        # started here, not before returning the response: a client gone
+        # before the first event never runs this body, so nothing would
+        # cancel them
+        async def tagged(role: str, task: "asyncio.Future[Any]") -> Tuple[str, Any]:
+            try:
+                return role, await task
+            except Exception:
+                # a failed or timed-out helper simply contributes nothing
+                return role, None
+
+        base_task = asyncio.ensure_future(
+            base_freigent.agenerate_recommendations_json(
+                user_profile=profile,
+                query=req.query,
+                use_cache=req.use_cache,
+            )
+        )
+        reply_tasks: List["asyncio.Task[A2AMessage]"] = []
+        base_result: Dict[str, Any] = {}
+        helper_results: List[HelperResult] = []
+        try:
+            helper_ids, reply_tasks = await _send_helper_requests(user_id, profile, req)
+            waiters = [tagged("base", base_task)]
+            waiters += [tagged("helper", task) for task in reply_tasks]
+            for next_done in asyncio.as_completed(waiters):
+                role, value = await next_done
+
+                if role == "base":
+                    base_result = value or {}
+                    yield "agent_result", {
+                        "agent_id": user_id,
+                        "role": "base",
+                        "result": base_result,
+                    }
+                    continue
+
+                # one helper replied (or gave up)
+                for hr in _helper_results_from([value] if value is not None else []):
+                    helper_results.append(hr)
+                    yield "agent_result", {
+                        "agent_id": hr.agent_id,
+                        "role": "helper",
+                        "result": hr.result,
+                    }
+
+            final = _merge_auto_search(user_id, helper_ids, base_result, helper_results)
+            yield "summary", final.dict()
+        finally:
+            for task in [base_task, *reply_tasks]:
+                task.cancel()
+
+    return streaming_response(events(), fmt)
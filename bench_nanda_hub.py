@@ -0,0 +1,131 @@
+# bench_nanda_hub.py
+"""
+Multi-threaded send/receive benchmark for NandaHub.
+
+Sender threads send to random agents while receiver threads drain their
+own agents' inboxes with receive(). Checks that every message is received
+exactly once and prints the throughput for each shard count.
+
+    python bench_nanda_hub.py --shards 1 16 --senders 8 --receivers 8
+
+--memory N queues N messages without receiving them and prints the send
+rate and the bytes held per queued message; with --capacity the inboxes
+are bounded (drop_oldest) and the footprint stays flat however many are sent.
+
+    python bench_nanda_hub.py --memory 2000000 --agents 1000
+    python bench_nanda_hub.py --memory 2000000 --agents 1000 --capacity 500
+"""
+import argparse
+import gc
+import random
+import threading
+import time
+import tracemalloc
+from typing import List
+
+from nanda_hub import OVERFLOW_DROP_OLDEST, NandaHub
+
+
+def run(num_shards: int, senders: int, receivers: int, agents: int, messages: int) -> None:
+    hub = NandaHub(num_shards=num_shards)
+    agent_ids = [f"agent-{i}" for i in range(agents)]
+    total = senders * messages
+    received: List[int] = [0] * receivers
+    seen: List[set] = [set() for _ in range(receivers)]
+    done = threading.Event()
+
+    def sender(index: int) -> None:
+        rng = random.Random(index)
+        for n in range(messages):
+            hub.send_message(f"sender-{index}", rng.choice(agent_ids), {"n": n})
+
+    def receiver(index: int) -> None:
+        own = agent_ids[index::receivers]
+        while not done.is_set():
+            got = 0
+            for agent_id in own:
+                for msg in hub.get_inbox(agent_id, clear=True):
+                    seen[index].add(msg.message_id)
+                    got += 1
+            received[index] += got
+            if not got:
+                # park on one of our inboxes until something arrives
+                for msg in hub.receive(own[0], timeout=0.001):
+                    seen[index].add(msg.message_id)
+                    received[index] += 1
+
+    rx = [threading.Thread(target=receiver, args=(i,)) for i in range(receivers)]
+    tx = [threading.Thread(target=sender, args=(i,)) for i in range(senders)]
+    start = time.perf_counter()
+    for t in rx + tx:
+        t.start()
+    for t in tx:
+        t.join()
+    while sum(received) < total and time.perf_counter() - start < 60:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    done.set()
+    for t in rx:
+        t.join()
+
+    unique = len(set().union(*seen))
+    status = "ok" if sum(received) == unique == total else "MISMATCH"
+    print(
+        f"shards={num_shards:<3} sent={total} received={sum(received)} unique={unique} "
+        f"{status}  {elapsed:.2f}s  {total / elapsed:,.0f} msg/s"
+    )
+
+
+def run_memory(messages: int, agents: int, capacity: int) -> None:
+    agent_ids = [f"agent-{i}" for i in range(agents)]
+
+    def fill(hub: NandaHub) -> float:
+        start = time.perf_counter()
+        for n in range(messages):
+            hub.send_message("sender", agent_ids[n % agents], {"n": n})
+        return time.perf_counter() - start
+
+    def new_hub() -> NandaHub:
+        return NandaHub(max_inbox_size=capacity, overflow=OVERFLOW_DROP_OLDEST)
+
+    # timed pass without tracing, then a traced pass for the footprint
+    elapsed = fill(new_hub())
+    gc.collect()
+    tracemalloc.start()
+    hub = new_hub()
+    fill(hub)
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queued = sum(hub.inbox_stats(a)["size"] for a in agent_ids)
+    dropped = sum(hub.inbox_stats(a)["dropped"] for a in agent_ids)
+    print(
+        f"sent={messages} queued={queued} dropped={dropped}  "
+        f"{messages / elapsed:,.0f} msg/s  held={held / 2**20:,.1f} MiB "
+        f"peak={peak / 2**20:,.1f} MiB  {held / max(1, queued):,.0f} B/queued msg"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--senders", type=int, default=8)
+    parser.add_argument("--receivers", type=int, default=8)
+    parser.add_argument("--agents", type=int, default=256)
+    parser.add_argument("--messages", type=int, default=20000, help="per sender")
+    parser.add_argument("--memory", type=int, default=0, metavar="N",
+                        help="queue N messages and report memory instead")
+    parser.add_argument("--capacity", type=int, default=0,
+                        help="per-inbox limit for --memory (0 = unbounded)")
+    args = parser.parse_args()
+
+    if args.memory:
+        run_memory(args.memory, args.agents, args.capacity)
+        return
+    for num_shards in args.shards:
+        run(num_shards, args.senders, args.receivers, args.agents, args.messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,872 @@
+import json
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+DB_PATH = os.getenv("FREIGENT_DB_PATH", "freigent.db")
+
+
+class SQLiteConnectionPool:
+    """
+    Small thread-safe pool of SQLite connections shared by the API modules.
+
+    Every connection is opened once and tuned for concurrent access:
+    - journal_mode=WAL, so readers never block behind a writer
+    - synchronous=NORMAL (safe with WAL, far fewer fsyncs)
+    - a larger page cache, memory-mapped I/O and a busy timeout, so
+      writers wait for each other instead of failing with 'database is locked'
+
+    Connections are created lazily up to `size`; callers that find the
+    pool empty wait until one is returned.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 8,
+        busy_timeout_ms: int = 5000,
+        cache_size_kib: int = 65536,
+        mmap_size: int = 268435456,
+    ) -> None:
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # negative cache_size is in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection for one unit of work.
+
+        Commits when the block exits normally, rolls back if it raises,
+        and always returns the connection to the pool.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_POOLS: Dict[str, SQLiteConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(db_path: str = DB_PATH) -> SQLiteConnectionPool:
+    """Process-wide pool for `db_path` (created on first use)."""
+    pool = _POOLS.get(db_path)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(db_path)
+            if pool is None:
+                pool = SQLiteConnectionPool(
+                    db_path,
+                    size=int(os.getenv("FREIGENT_DB_POOL_SIZE", "8")),
+                    busy_timeout_ms=int(os.getenv("FREIGENT_DB_BUSY_TIMEOUT_MS", "5000")),
+                    cache_size_kib=int(os.getenv("FREIGENT_DB_CACHE_SIZE_KIB", "65536")),
+                    mmap_size=int(os.getenv("FREIGENT_DB_MMAP_SIZE", "268435456")),
+                )
+                _POOLS[db_path] = pool
+    return pool
+
+
+def db_connection(db_path: str = DB_PATH) -> ContextManager[sqlite3.Connection]:
+    """Shortcut for get_pool(db_path).connection()."""
+    return get_pool(db_path).connection()
+
+
+# ----------------------------------------------------------------------
+# Profile term index (helper ranking)
+# ----------------------------------------------------------------------
+# profile_terms holds a small normalized term vector per profile, written
+# together with the profile itself. Ranking helpers for a query is then an
+# indexed lookup of the query's terms instead of a scan over every profile.
+# profile_term_stats (document frequency per term) and profile_stats (the
+# profile count) are kept up to date by the same writes, so the IDF weights
+# are lookups too.
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset(
+    """
+    a about an and are as at be but by for from has have i in is it its me
+    my not of on or our so that the their them they this to too was we
+    were what when which who will with you your very really like just
+    """.split()
+)
+
+# Terms kept per profile / per ranking query (bounds rows and SQL params)
+MAX_TERMS_PER_PROFILE = int(os.getenv("FREIGENT_MAX_TERMS_PER_PROFILE", "64"))
+MAX_RANK_TERMS = 64
+# Ranking skips terms found in more than this fraction of all profiles (and
+# in more than RANK_TERM_MIN_DOC_FREQ of them): one generic word would
+# otherwise make the query join nearly every profile_terms row
+MAX_RANK_TERM_DOC_FRACTION = float(os.getenv("FREIGENT_MAX_RANK_TERM_DOC_FRACTION", "0.05"))
+RANK_TERM_MIN_DOC_FREQ = 1000
+
+
+def text_terms(text: str) -> Dict[str, int]:
+    """Lowercased word counts of `text`, minus stopwords and 1-2 letter tokens."""
+    counts: Dict[str, int] = {}
+    for term in _TERM_RE.findall((text or "").lower()):
+        if len(term) < 3 or term in _STOPWORDS:
+            continue
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def term_weights(counts: Dict[str, int], limit: int = MAX_TERMS_PER_PROFILE) -> Dict[str, float]:
+    """
+    Turn term counts into an L2-normalized, sublinear (1 + log tf) vector
+    keeping only the `limit` strongest terms, so long profiles don't
+    outrank short ones just by being long.
+    """
+    weights = {t: 1.0 + math.log(c) for t, c in counts.items()}
+    if len(weights) > limit:
+        weights = dict(
+            sorted(weights.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+        )
+    norm = math.sqrt(sum(w * w for w in weights.values()))
+    if not norm:
+        return {}
+    return {t: w / norm for t, w in weights.items()}
+
+
+def profile_term_weights(profile: Dict[str, Any]) -> Dict[str, float]:
+    """Term vector of a profile_dict (name, personality, values, experiences)."""
+    parts = [
+        profile.get("name", ""),
+        profile.get("personality", ""),
+        profile.get("values", ""),
+    ]
+    for exp in profile.get("experiences", []):
+        parts.append(exp.get("name", ""))
+        parts.append(exp.get("notes", ""))
+    return term_weights(text_terms(" ".join(p or "" for p in parts)))
+
+
+def db_index_profile_terms(
+    conn: sqlite3.Connection, items: Iterable[Tuple[str, Dict[str, Any]]]
+) -> None:
+    """
+    Replace the profile_terms rows of each (user_id, profile_dict).
+
+    Runs on the caller's connection so the index (and its document
+    frequencies) is written in the same transaction as the profile itself.
+    """
+    vectors = [(user_id, profile_term_weights(profile)) for user_id, profile in items]
+
+    doc_freq_delta: Dict[str, int] = {}
+    user_ids = [user_id for user_id, _ in vectors]
+    for start in range(0, len(user_ids), IN_CHUNK_SIZE):
+        chunk = user_ids[start : start + IN_CHUNK_SIZE]
+        placeholders = ", ".join("?" for _ in chunk)
+        for row in conn.execute(
+            f"SELECT term FROM profile_terms WHERE user_id IN ({placeholders})", chunk
+        ):
+            doc_freq_delta[row["term"]] = doc_freq_delta.get(row["term"], 0) - 1
+    for _, weights in vectors:
+        for term in weights:
+            doc_freq_delta[term] = doc_freq_delta.get(term, 0) + 1
+    conn.executemany(
+        """
+        INSERT INTO profile_term_stats (term, doc_freq) VALUES (?, ?)
+        ON CONFLICT(term) DO UPDATE SET doc_freq = doc_freq + excluded.doc_freq
+        """,
+        [(term, delta) for term, delta in doc_freq_delta.items() if delta],
+    )
+    _replace_profile_terms(conn, vectors)
+
+
+def _replace_profile_terms(
+    conn: sqlite3.Connection, vectors: List[Tuple[str, Dict[str, float]]]
+) -> None:
+    conn.executemany(
+        "DELETE FROM profile_terms WHERE user_id = ?",
+        [(user_id,) for user_id, _ in vectors],
+    )
+    conn.executemany(
+        "INSERT INTO profile_terms (user_id, term, weight) VALUES (?, ?, ?)",
+        [
+            (user_id, term, weight)
+            for user_id, weights in vectors
+            for term, weight in weights.items()
+        ],
+    )
+
+
+def _backfill_profile_terms(conn: sqlite3.Connection) -> None:
+    """Migration step: index the profiles that existed before profile_terms."""
+    profiles: Dict[str, Dict[str, Any]] = {}
+    for row in conn.execute("SELECT user_id, name, personality, values_text FROM profiles"):
+        profiles[row["user_id"]] = {
+            "name": row["name"],
+            "personality": row["personality"],
+            "values": row["values_text"],
+            "experiences": [],
+        }
+    for er in conn.execute("SELECT user_id, name, notes FROM experiences ORDER BY id"):
+        profile = profiles.get(er["user_id"])
+        if profile is not None:
+            profile["experiences"].append({"name": er["name"], "notes": er["notes"]})
+    _replace_profile_terms(
+        conn, [(user_id, profile_term_weights(p)) for user_id, p in profiles.items()]
+    )
+
+
+# ----------------------------------------------------------------------
+# Schema migrations
+# ----------------------------------------------------------------------
+# Each migration is (version, description, steps). A step is either a SQL
+# statement or a callable(conn) for changes that need to inspect the live
+# schema first. Migrations are append-only: never edit a released one, add
+# a new version instead. The applied version is stored in PRAGMA user_version.
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (
+        1,
+        "base tables: agents, profiles, experiences",
+        [
+            # IMPORTANT: use 'values_text' instead of SQL reserved word 'values'
+            """
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id TEXT PRIMARY KEY,
+                agent_type TEXT NOT NULL,
+                display_name TEXT NOT NULL,
+                personality_summary TEXT DEFAULT ''
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS profiles (
+                user_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                personality TEXT NOT NULL,
+                values_text TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS experiences (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                notes TEXT NOT NULL,
+                rating INTEGER NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES profiles(user_id)
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "indexes for per-user experience lookups and agent type filtering",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_experiences_user_id ON experiences (user_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_agents_agent_type ON agents (agent_type)",
+        ],
+    ),
+    (
+        3,
+        "recommendation cache table",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS recommendation_cache (
+                cache_key TEXT PRIMARY KEY,
+                value_json TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_recommendation_cache_expires_at "
+            "ON recommendation_cache (expires_at)",
+            "CREATE INDEX IF NOT EXISTS idx_recommendation_cache_last_access "
+            "ON recommendation_cache (last_access)",
+        ],
+    ),
+    (
+        4,
+        "profile_terms index for helper ranking",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS profile_terms (
+                term TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (term, user_id)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_profile_terms_user_id ON profile_terms (user_id)",
+            _backfill_profile_terms,
+        ],
+    ),
+    (
+        5,
+        "profiles.updated_seq change sequence for incremental index refresh",
+        [
+            "ALTER TABLE profiles ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_profiles_updated_seq ON profiles (updated_seq)",
+        ],
+    ),
+    (
+        6,
+        "durable NandaHub: a2a_agents and the a2a_messages queue",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS a2a_agents (
+                agent_id TEXT PRIMARY KEY,
+                agent_type TEXT NOT NULL,
+                display_name TEXT NOT NULL,
+                personality_summary TEXT DEFAULT ''
+            )
+            """,
+            # visible_at: 0 = queued, otherwise leased until that time.time()
+            """
+            CREATE TABLE IF NOT EXISTS a2a_messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id TEXT NOT NULL UNIQUE,
+                from_agent_id TEXT NOT NULL,
+                to_agent_id TEXT NOT NULL,
+                payload_type TEXT,
+                correlation_id TEXT,
+                payload_json TEXT NOT NULL,
+                expires_at REAL,
+                visible_at REAL NOT NULL DEFAULT 0
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_a2a_messages_inbox "
+            "ON a2a_messages (to_agent_id, visible_at, seq)",
+            "CREATE INDEX IF NOT EXISTS idx_a2a_messages_type "
+            "ON a2a_messages (payload_type, visible_at)",
+            "CREATE INDEX IF NOT EXISTS idx_a2a_messages_correlation_id "
+            "ON a2a_messages (correlation_id) WHERE correlation_id IS NOT NULL",
+        ],
+    ),
+    (
+        7,
+        "durable NandaHub: topic subscriptions and consumer-group cursors",
+        [
+            # group_name '' = plain subscriber (gets every message)
+            """
+            CREATE TABLE IF NOT EXISTS a2a_subscriptions (
+                topic TEXT NOT NULL,
+                group_name TEXT NOT NULL DEFAULT '',
+                agent_id TEXT NOT NULL,
+                PRIMARY KEY (topic, group_name, agent_id)
+            ) WITHOUT ROWID
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS a2a_group_cursors (
+                topic TEXT NOT NULL,
+                group_name TEXT NOT NULL,
+                next_index INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (topic, group_name)
+            ) WITHOUT ROWID
+            """,
+        ],
+    ),
+    (
+        8,
+        "durable NandaHub: per-take lease token checked by ack / nack",
+        [
+            "ALTER TABLE a2a_messages ADD COLUMN lease_token TEXT",
+        ],
+    ),
+    (
+        9,
+        "profile_term_stats / profile_stats: maintained IDF inputs for helper ranking",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS profile_term_stats (
+                term TEXT PRIMARY KEY,
+                doc_freq INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """,
+            """
+            INSERT OR REPLACE INTO profile_term_stats (term, doc_freq)
+            SELECT term, COUNT(*) FROM profile_terms GROUP BY term
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS profile_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                profile_count INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR REPLACE INTO profile_stats (id, profile_count) "
+            "SELECT 1, COUNT(*) FROM profiles",
+            # an upsert that updates an existing profile fires no INSERT trigger
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_profiles_count_insert AFTER INSERT ON profiles
+            BEGIN
+                UPDATE profile_stats SET profile_count = profile_count + 1 WHERE id = 1;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_profiles_count_delete AFTER DELETE ON profiles
+            BEGIN
+                UPDATE profile_stats SET profile_count = profile_count - 1 WHERE id = 1;
+            END
+            """,
+        ],
+    ),
+    (
+        10,
+        "recommendation_cache_compaction: one compaction per interval across processes",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS recommendation_cache_compaction (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                next_run_at REAL NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO recommendation_cache_compaction (id, next_run_at) VALUES (1, 0)",
+        ],
+    ),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str = DB_PATH) -> int:
+    """
+    Bring the database at `db_path` up to SCHEMA_VERSION.
+
+    Each pending migration runs in its own BEGIN IMMEDIATE transaction
+    together with the user_version bump, so a failed step leaves the DB at
+    the previous version, and several workers starting at once apply each
+    migration exactly once (the others wait on the write lock, then see the
+    new version and skip it). Databases created before migrations existed
+    report version 0; the CREATE ... IF NOT EXISTS steps adopt them as-is.
+
+    Returns the schema version after migrating.
+    """
+    with db_connection(db_path) as conn:
+        for version, _description, steps in MIGRATIONS:
+            if get_schema_version(conn) >= version:
+                continue
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # re-check under the write lock: another process may have won
+                if get_schema_version(conn) < version:
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        return get_schema_version(conn)
+
+
+def init_db(db_path: str = DB_PATH) -> None:
+    """Create / upgrade the Freigent schema (safe to call on every startup)."""
+    migrate(db_path)
+
+
+# Assigns profiles.updated_seq inside an INSERT/UPDATE: the statement holds
+# the write lock while evaluating it, so sequence numbers increase in
+# commit order and readers can follow changes with "updated_seq > ?".
+NEXT_PROFILE_SEQ_SQL = "(SELECT COALESCE(MAX(updated_seq), 0) + 1 FROM profiles)"
+
+
+def db_changed_profile_ids(
+    after_seq: int, db_path: str = DB_PATH
+) -> List[Tuple[str, int]]:
+    """[(user_id, updated_seq)] of profiles written after `after_seq`, oldest first."""
+    with db_connection(db_path) as conn:
+        rows = conn.execute(
+            """
+            SELECT user_id, updated_seq
+            FROM profiles
+            WHERE updated_seq > ?
+            ORDER BY updated_seq
+            """,
+            (after_seq,),
+        ).fetchall()
+    return [(row["user_id"], row["updated_seq"]) for row in rows]
+
+
+# Max bound parameters per IN (...) list; SQLite's historic limit is 999.
+IN_CHUNK_SIZE = 500
+
+
+def db_load_profiles(
+    user_ids: Iterable[str], db_path: str = DB_PATH
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Batched profile loader: fetch many profiles and all their experiences
+    in a constant number of queries (two per IN_CHUNK_SIZE ids), instead
+    of one profile query + one experiences query per user.
+
+    Returns {user_id: profile_dict} for the ids that have a profile, where
+    profile_dict has the usual shape:
+    {"name", "personality", "values", "experiences": [{"name", "notes", "rating"}]}
+    Experiences keep their insertion order.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    profiles: Dict[str, Dict[str, Any]] = {}
+    if not ids:
+        return profiles
+
+    with db_connection(db_path) as conn:
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            chunk = ids[start : start + IN_CHUNK_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+
+            for row in conn.execute(
+                f"""
+                SELECT user_id, name, personality, values_text
+                FROM profiles
+                WHERE user_id IN ({placeholders})
+                """,
+                chunk,
+            ):
+                profiles[row["user_id"]] = {
+                    "name": row["name"] or "",
+                    "personality": row["personality"] or "",
+                    "values": row["values_text"] or "",
+                    "experiences": [],
+                }
+
+            for er in conn.execute(
+                f"""
+                SELECT user_id, name, notes, rating
+                FROM experiences
+                WHERE user_id IN ({placeholders})
+                ORDER BY user_id, id ASC
+                """,
+                chunk,
+            ):
+                profile = profiles.get(er["user_id"])
+                if profile is not None:
+                    profile["experiences"].append(
+                        {
+                            "name": er["name"],
+                            "notes": er["notes"],
+                            "rating": er["rating"],
+                        }
+                    )
+
+    return profiles
+
+
+def db_rank_profiles(
+    weighted_terms: Dict[str, float],
+    limit: int,
+    agent_type: Optional[str] = None,
+    exclude_user_id: Optional[str] = None,
+    db_path: str = DB_PATH,
+) -> List[Tuple[str, float]]:
+    """
+    Rank profiles against a weighted term vector using profile_terms.
+
+    Each term is additionally weighted by its inverse document frequency,
+    so rare terms ("espresso") count for more than ones every profile
+    shares (read from profile_term_stats / profile_stats); terms too common
+    to tell profiles apart (see MAX_RANK_TERM_DOC_FRACTION) are skipped.
+    Score = sum(query_weight * idf * profile_weight) over shared terms.
+    Only profiles sharing at least one term are returned, best first, at
+    most `limit` of them. If agent_type is given, only users registered in
+    `agents` with that type are considered.
+    """
+    if limit <= 0 or not weighted_terms:
+        return []
+    terms = sorted(weighted_terms.items(), key=lambda kv: (-kv[1], kv[0]))[:MAX_RANK_TERMS]
+
+    with db_connection(db_path) as conn:
+        placeholders = ", ".join("?" for _ in terms)
+        doc_freq = {
+            row["term"]: row["doc_freq"]
+            for row in conn.execute(
+                f"""
+                SELECT term, doc_freq
+                FROM profile_term_stats
+                WHERE term IN ({placeholders}) AND doc_freq > 0
+                """,
+                [t for t, _ in terms],
+            )
+        }
+        if not doc_freq:
+            return []
+        row = conn.execute("SELECT profile_count FROM profile_stats WHERE id = 1").fetchone()
+        total = max(row[0] if row else 0, 1)
+        max_doc_freq = max(MAX_RANK_TERM_DOC_FRACTION * total, RANK_TERM_MIN_DOC_FREQ)
+        doc_freq = {t: df for t, df in doc_freq.items() if df <= max_doc_freq}
+        if not doc_freq:
+            return []
+
+        query_rows = [
+            (t, w * math.log(1.0 + total / doc_freq[t]))
+            for t, w in terms
+            if t in doc_freq
+        ]
+        values = ", ".join("(?, ?)" for _ in query_rows)
+        params: List[Any] = [x for row in query_rows for x in row]
+
+        filters = ""
+        if agent_type is not None:
+            filters += " AND pt.user_id IN (SELECT agent_id FROM agents WHERE agent_type = ?)"
+            params.append(agent_type)
+        if exclude_user_id is not None:
+            filters += " AND pt.user_id != ?"
+            params.append(exclude_user_id)
+        params.append(int(limit))
+
+        rows = conn.execute(
+            f"""
+            WITH q(term, weight) AS (VALUES {values})
+            SELECT pt.user_id, SUM(q.weight * pt.weight) AS score
+            FROM q
+            JOIN profile_terms pt ON pt.term = q.term
+            WHERE 1 = 1{filters}
+            GROUP BY pt.user_id
+            ORDER BY score DESC, pt.user_id
+            LIMIT ?
+            """,
+            params,
+        ).fetchall()
+
+    return [(row["user_id"], row["score"]) for row in rows]
+
+
+# ----------------------------------------------------------------------
+# Bulk ingestion
+# ----------------------------------------------------------------------
+def parse_bulk_records(body: bytes) -> List[Tuple[Any, Optional[str]]]:
+    """
+    Split a bulk request body into records.
+
+    Accepts either a JSON array of objects or NDJSON (one JSON object per
+    line, blank lines ignored). Returns one (record, error) pair per
+    record, in input order; a line that isn't valid JSON yields
+    (None, error_message) so it can be reported without failing the rest.
+    """
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+
+    if text.startswith("["):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON array: {e}") from e
+        return [(item, None) for item in items]
+
+    records: List[Tuple[Any, Optional[str]]] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append((json.loads(line), None))
+        except json.JSONDecodeError as e:
+            records.append((None, f"Invalid JSON line: {e}"))
+    return records
+
+
+def db_bulk_upsert_profiles(
+    items: List[Tuple[str, Dict[str, Any]]],
+    agent_type: Optional[str] = None,
+    db_path: str = DB_PATH,
+) -> None:
+    """
+    Upsert many profiles (and replace their experiences) in ONE transaction
+    using executemany, instead of a connection + transaction per profile.
+
+    items: [(user_id, profile_dict)] with the usual profile_dict shape.
+    If the same user_id appears more than once, the last one wins.
+    If agent_type is given, each user is also upserted into `agents`
+    (display_name = profile name, personality_summary = personality).
+
+    Either the whole batch is written or none of it (the caller decides
+    the batch size).
+    """
+    latest: Dict[str, Dict[str, Any]] = {}
+    for user_id, profile in items:
+        latest[user_id] = profile
+
+    profile_rows = [
+        (
+            user_id,
+            p.get("name", ""),
+            p.get("personality", ""),
+            p.get("values", ""),
+        )
+        for user_id, p in latest.items()
+    ]
+    experience_rows = [
+        (
+            user_id,
+            exp.get("name", ""),
+            exp.get("notes", ""),
+            int(exp.get("rating", 0)),
+        )
+        for user_id, p in latest.items()
+        for exp in p.get("experiences", [])
+    ]
+
+    with db_connection(db_path) as conn:
+        conn.executemany(
+            f"""
+            INSERT INTO profiles (user_id, name, personality, values_text, updated_seq)
+            VALUES (?, ?, ?, ?, {NEXT_PROFILE_SEQ_SQL})
+            ON CONFLICT(user_id) DO UPDATE SET
+                name = excluded.name,
+                personality = excluded.personality,
+                values_text = excluded.values_text,
+                updated_seq = excluded.updated_seq
+            """,
+            profile_rows,
+        )
+        conn.executemany(
+            "DELETE FROM experiences WHERE user_id = ?",
+            [(user_id,) for user_id in latest],
+        )
+        conn.executemany(
+            """
+            INSERT INTO experiences (user_id, name, notes, rating)
+            VALUES (?, ?, ?, ?)
+            """,
+            experience_rows,
+        )
+        db_index_profile_terms(conn, latest.items())
+        if agent_type is not None:
+            conn.executemany(
+                """
+                INSERT INTO agents (agent_id, agent_type, display_name, personality_summary)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(agent_id) DO UPDATE SET
+                    agent_type = excluded.agent_type,
+                    display_name = excluded.display_name,
+                    personality_summary = excluded.personality_summary
+                """,
+                [
+                    (user_id, agent_type, name, personality)
+                    for user_id, name, personality, _ in profile_rows
+                ],
+            )
+
+
+def db_bulk_ingest(
+    records: List[Tuple[Any, Optional[str]]],
+    to_item: Callable[[Any], Tuple[str, Dict[str, Any]]],
+    batch_size: int = 5000,
+    agent_type: Optional[str] = None,
+    db_path: str = DB_PATH,
+) -> List[Dict[str, Any]]:
+    """
+    Validate and write parsed bulk records, batch_size records per transaction.
+
+    to_item turns one raw record into (user_id, profile_dict) and raises
+    on invalid input. Returns one status dict per record, in input order:
+    {"index", "user_id", "status": "ok" | "error", "error"?}.
+    A DB failure only fails the records of its own batch.
+    """
+    results: List[Dict[str, Any]] = []
+    batch: List[Tuple[str, Dict[str, Any]]] = []
+    batch_results: List[Dict[str, Any]] = []
+
+    def flush() -> None:
+        if not batch:
+            return
+        try:
+            db_bulk_upsert_profiles(batch, agent_type=agent_type, db_path=db_path)
+        except sqlite3.Error as e:
+            for r in batch_results:
+                r["status"] = "error"
+                r["error"] = f"Database error: {e}"
+        batch.clear()
+        batch_results.clear()
+
+    for index, (record, parse_error) in enumerate(records):
+        status: Dict[str, Any] = {"index": index, "user_id": None, "status": "ok"}
+        results.append(status)
+
+        if parse_error is not None:
+            status.update(status="error", error=parse_error)
+            continue
+        try:
+            user_id, profile = to_item(record)
+        except Exception as e:
+            if isinstance(record, dict):
+                status["user_id"] = record.get("user_id")
+            status.update(status="error", error=str(e))
+            continue
+
+        status["user_id"] = user_id
+        batch.append((user_id, profile))
+        batch_results.append(status)
+        if len(batch) >= batch_size:
+            flush()
+
+    flush()
+    return results
@@ -1,9 +1,22 @@
 import os
+import asyncio
+import copy
+import hashlib
 import json
-from typing import Dict, Any, List
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass
 
-from anthropic import Anthropic
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+from freigent_db import DB_PATH, get_pool, init_db
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class ProductExperience:
@@ -18,6 +31,508 @@ class UserProfile:
     values: str
     experiences: List[ProductExperience] # כדאי לוודא ש-List מיובא (כפי שמופיע בראש הקובץ)
 
+class LLMClientPool:
+    """
+    Process-wide Anthropic clients shared by every RealJsonFreigent.
+
+    One sync and one async client are created lazily, each with its own
+    keep-alive HTTP connection pool, so agents reuse open TLS connections
+    instead of building a new pool per agent. Limits come from env:
+    - ANTHROPIC_MAX_CONNECTIONS
+    - ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS
+    - ANTHROPIC_KEEPALIVE_EXPIRY_SECONDS
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._lock = threading.Lock()
+        self._client: Optional[Anthropic] = None
+        self._async_client: Optional[AsyncAnthropic] = None
+
+    def _api_key(self) -> str:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise ValueError("ANTHROPIC_API_KEY is not set in environment/.env")
+        return api_key
+
+    @property
+    def client(self) -> Anthropic:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = Anthropic(
+                        api_key=self._api_key(),
+                        http_client=DefaultHttpxClient(limits=self.limits),
+                    )
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncAnthropic:
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = AsyncAnthropic(
+                        api_key=self._api_key(),
+                        http_client=DefaultAsyncHttpxClient(limits=self.limits),
+                    )
+        return self._async_client
+
+
+# Global singleton shared by all RealJsonFreigent instances in this process
+LLM_CLIENT_POOL = LLMClientPool(
+    max_connections=int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(
+        os.getenv("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", "20")
+    ),
+    keepalive_expiry=float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY_SECONDS", "60")),
+)
+
+
+class RecommendationCache:
+    """
+    In-memory TTL + LRU cache of recommendation results.
+
+    Keys come from make_cache_key(), so any change to the profile text,
+    the normalized query or the model produces a different key and an
+    updated profile can never be answered from an older entry.
+    Values are deep-copied in and out so callers can't mutate the cache.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            # mark as most recently used
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get(key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        entry = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            # evict least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        self.set(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold and collapse whitespace so trivial variations share a key."""
+    return " ".join(query.split()).casefold()
+
+
+def make_cache_key(profile_text: str, query: str, model_name: str) -> str:
+    """Stable hash of (profile text, normalized query, model)."""
+    h = hashlib.sha256()
+    for part in (model_name, profile_text, normalize_query(query)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class SQLiteRecommendationCache:
+    """
+    Recommendation cache stored in a table of the Freigent SQLite DB
+    (through the shared freigent_db connection pool).
+
+    Same get/set interface as RecommendationCache, but shared by every
+    uvicorn worker and kept across restarts; aget/aset run the queries in
+    a worker thread. Entries expire after ttl_seconds. Every
+    compact_interval seconds a daemon thread tries to claim the
+    recommendation_cache_compaction row; the one process that wins deletes
+    expired rows and trims the table back to max_entries, evicting the
+    least recently used rows first. Writes never compact.
+
+    last_access is only rewritten when it is older than touch_interval
+    seconds, so hot keys don't turn every read into a write.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: int = 100_000,
+        ttl_seconds: float = 3600.0,
+        compact_interval: float = 300.0,
+        touch_interval: float = 60.0,
+    ) -> None:
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.compact_interval = compact_interval
+        self.touch_interval = touch_interval
+        self._pool = get_pool(db_path)
+        # the recommendation_cache tables are created by the schema migrations
+        init_db(db_path)
+
+        self._stop = threading.Event()
+        self._compactor: Optional[threading.Thread] = None
+        if compact_interval > 0 and max_entries > 0 and ttl_seconds > 0:
+            self._compactor = threading.Thread(
+                target=self._compact_loop, name="recommendation-cache-compactor", daemon=True
+            )
+            self._compactor.start()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT value_json, last_access FROM recommendation_cache
+                WHERE cache_key = ? AND expires_at > ?
+                """,
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            if now - row["last_access"] >= self.touch_interval:
+                conn.execute(
+                    "UPDATE recommendation_cache SET last_access = ? WHERE cache_key = ?",
+                    (now, key),
+                )
+        return json.loads(row["value_json"])
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        now = time.time()
+        with self._pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO recommendation_cache (cache_key, value_json, expires_at, last_access)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    value_json = excluded.value_json,
+                    expires_at = excluded.expires_at,
+                    last_access = excluded.last_access
+                """,
+                (key, json.dumps(value), now + self.ttl_seconds, now),
+            )
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.set, key, value)
+
+    def close(self) -> None:
+        """Stop the compaction thread."""
+        compactor, self._compactor = self._compactor, None
+        if compactor is not None:
+            self._stop.set()
+            compactor.join()
+
+    def _compact_loop(self) -> None:
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self._maybe_compact(time.time())
+            except sqlite3.Error:
+                logger.exception("recommendation cache compaction failed")
+
+    def _maybe_compact(self, now: float) -> None:
+        """Compact if no process has done so in the last compact_interval."""
+        with self._pool.connection() as conn:
+            claimed = conn.execute(
+                """
+                UPDATE recommendation_cache_compaction SET next_run_at = ?
+                WHERE id = 1 AND next_run_at <= ?
+                """,
+                (now + self.compact_interval, now),
+            ).rowcount
+            # same transaction: if compacting fails, so does the claim
+            if claimed:
+                self._compact(conn)
+
+    def compact(self) -> int:
+        """Delete expired rows and trim to max_entries. Returns rows removed."""
+        with self._pool.connection() as conn:
+            return self._compact(conn)
+
+    def _compact(self, conn: sqlite3.Connection) -> int:
+        removed = conn.execute(
+            "DELETE FROM recommendation_cache WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+        (count,) = conn.execute(
+            "SELECT COUNT(*) FROM recommendation_cache"
+        ).fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            removed += conn.execute(
+                """
+                DELETE FROM recommendation_cache WHERE cache_key IN (
+                    SELECT cache_key FROM recommendation_cache
+                    ORDER BY last_access ASC
+                    LIMIT ?
+                )
+                """,
+                (overflow,),
+            ).rowcount
+        return removed
+
+    def clear(self) -> None:
+        with self._pool.connection() as conn:
+            conn.execute("DELETE FROM recommendation_cache")
+
+    def __len__(self) -> int:
+        with self._pool.connection() as conn:
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM recommendation_cache WHERE expires_at > ?",
+                (time.time(),),
+            ).fetchone()
+        return count
+
+
+def create_recommendation_cache() -> Any:
+    """
+    Build the cache selected by FREIGENT_CACHE_BACKEND:
+    - "memory" (default): per-process RecommendationCache
+    - "sqlite": SQLiteRecommendationCache in FREIGENT_DB_PATH, shared by
+      all workers and restarts
+    """
+    backend = os.getenv("FREIGENT_CACHE_BACKEND", "memory").lower()
+    max_entries = os.getenv("FREIGENT_CACHE_MAX_ENTRIES")
+    ttl_seconds = os.getenv("FREIGENT_CACHE_TTL_SECONDS")
+
+    if backend == "sqlite":
+        return SQLiteRecommendationCache(
+            db_path=DB_PATH,
+            max_entries=int(max_entries or "100000"),
+            ttl_seconds=float(ttl_seconds or "3600"),
+            compact_interval=float(
+                os.getenv("FREIGENT_CACHE_COMPACT_INTERVAL_SECONDS", "300")
+            ),
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown FREIGENT_CACHE_BACKEND '{backend}'")
+
+    return RecommendationCache(
+        max_entries=int(max_entries or "1024"),
+        ttl_seconds=float(ttl_seconds or "600"),
+    )
+
+
+# Global cache shared by all RealJsonFreigent instances in this process
+RECOMMENDATION_CACHE = create_recommendation_cache()
+
+
+class _Flight:
+    """One in-flight sync call that followers can wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical requests into one underlying call.
+
+    The first caller for a key (the leader) runs the call; callers that
+    arrive with the same key while it is in flight wait for it and get
+    a deep copy of the same result (taken from a snapshot nobody else
+    holds, so a caller mutating its result can't race the copies).
+    Nothing is remembered once the call finishes - that is the cache's job.
+
+    do() serves the sync path (threads); ado() serves the async path and
+    runs the call as a task so one cancelled waiter can't cancel it for
+    the others.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks: Dict[Tuple[int, str], "asyncio.Task[Dict[str, Any]]"] = {}
+
+    def do(self, key: str, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = fn()
+            # followers copy this snapshot, never the dict the leader returns
+            flight.result = copy.deepcopy(result)
+            return result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def ado(
+        self, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        # tasks belong to one event loop, so flights are tracked per loop
+        # (several loops, in different threads, may share this instance)
+        task_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is None:
+                task = asyncio.ensure_future(fn())
+                self._tasks[task_key] = task
+                task.add_done_callback(lambda _: self._forget_task(task_key))
+
+        result = await asyncio.shield(task)
+        # the task's result is shared by every waiter: each gets its own copy
+        return copy.deepcopy(result)
+
+    def _forget_task(self, task_key: Tuple[int, str]) -> None:
+        with self._lock:
+            self._tasks.pop(task_key, None)
+
+    def in_flight(self) -> int:
+        return len(self._flights) + len(self._tasks)
+
+
+# Global coordinator shared by all RealJsonFreigent instances in this process
+SINGLE_FLIGHT = SingleFlight()
+
+
+def profile_to_text(profile: Dict[str, Any]) -> str:
+    """Render a profile_dict as the text block given to the LLM (and indexed)."""
+    name = profile.get("name", "Unknown user")
+    personality = profile.get("personality", "")
+    values = profile.get("values", "")
+    experiences: List[Dict[str, Any]] = profile.get("experiences", [])
+
+    exp_lines = []
+    for e in experiences:
+        exp_name = e.get("name", "Unknown product")
+        notes = e.get("notes", "")
+        rating = e.get("rating", None)
+        if rating is not None:
+            exp_lines.append(f"- {exp_name} (rating {rating}/5): {notes}")
+        else:
+            exp_lines.append(f"- {exp_name}: {notes}")
+
+    if not exp_lines:
+        exp_text = "No concrete past product experience."
+    else:
+        exp_text = "\n".join(exp_lines)
+
+    return (
+        f"User name: {name}\n"
+        f"Personality: {personality}\n"
+        f"Values in products: {values}\n"
+        f"Past product experience:\n{exp_text}\n"
+    )
+
+
+class IncrementalProductParser:
+    """
+    Pulls product objects out of a JSON completion while it is still
+    being streamed.
+
+    feed() takes the next text chunk and returns every object of the
+    top-level "products" array whose closing brace has now arrived, already
+    decoded with json.loads. It only tracks nesting depth and string/escape
+    state, so each character is looked at once and nothing is re-parsed.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_key = ""
+        self._in_products = False
+        self._item_start = -1
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        products: List[Dict[str, Any]] = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # the last string seen directly in the top object is
+                        # the key of whatever value comes next
+                        self._last_key = text[self._string_start + 1 : i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if ch == "[" and self._depth == 1 and self._last_key == "products":
+                    self._in_products = True
+                elif ch == "{" and self._in_products and self._depth == 2:
+                    self._item_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._in_products and self._depth == 2 and ch == "}":
+                    try:
+                        item = json.loads(text[self._item_start : i + 1])
+                    except ValueError:
+                        item = None
+                    if isinstance(item, dict):
+                        products.append(item)
+                    self._item_start = -1
+                elif self._in_products and self._depth == 1:
+                    self._in_products = False
+
+        self._pos = len(text)
+        return products
+
+
 class RealJsonFreigent:
     """
     A 'real' Freigent that talks to Anthropic and returns
@@ -25,6 +540,11 @@ class RealJsonFreigent:
 
     This class does NOT know anything about HTTP or FastAPI.
     It just gets a user profile + query, and returns a Python dict.
+
+    Instances are cheap: they only hold identity and prompt settings,
+    while the Anthropic clients come from the shared LLM_CLIENT_POOL,
+    successful results are stored in the shared RECOMMENDATION_CACHE and
+    identical concurrent requests are collapsed by SINGLE_FLIGHT.
     """
 
     def __init__(self, agent_id: str) -> None:
@@ -35,57 +555,32 @@ class RealJsonFreigent:
 
         # Use the same model config that already works for you in main.py
         self.model_name = os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307")
-        self.client = Anthropic(api_key=api_key)
+        self.client_pool = LLM_CLIENT_POOL
+        self.cache = RECOMMENDATION_CACHE
+        self.flights = SINGLE_FLIGHT
+
+    @property
+    def client(self) -> Anthropic:
+        return self.client_pool.client
+
+    @property
+    def async_client(self) -> AsyncAnthropic:
+        return self.client_pool.async_client
 
     # ------------------------------------------------------------------
     # Helper: turn profile dict into a readable text block
     # ------------------------------------------------------------------
     def _profile_to_text(self, profile: Dict[str, Any]) -> str:
-        name = profile.get("name", "Unknown user")
-        personality = profile.get("personality", "")
-        values = profile.get("values", "")
-        experiences: List[Dict[str, Any]] = profile.get("experiences", [])
-
-        exp_lines = []
-        for e in experiences:
-            exp_name = e.get("name", "Unknown product")
-            notes = e.get("notes", "")
-            rating = e.get("rating", None)
-            if rating is not None:
-                exp_lines.append(f"- {exp_name} (rating {rating}/5): {notes}")
-            else:
-                exp_lines.append(f"- {exp_name}: {notes}")
-
-        if not exp_lines:
-            exp_text = "No concrete past product experience."
-        else:
-            exp_text = "\n".join(exp_lines)
-
-        return (
-            f"User name: {name}\n"
-            f"Personality: {personality}\n"
-            f"Values in products: {values}\n"
-            f"Past product experience:\n{exp_text}\n"
-        )
+        return profile_to_text(profile)
 
     # ------------------------------------------------------------------
-    # Main method: generate JSON recommendations
+    # Helper: build the (system, user) prompt pair for one request
     # ------------------------------------------------------------------
-    def generate_recommendations_json(
+    def _build_prompts(
         self,
         user_profile: Dict[str, Any],
         query: str,
-    ) -> Dict[str, Any]:
-        """
-        Calls Anthropic and asks it to return ONLY valid JSON with
-        a list of products and a summary_for_user.
-
-        Returns a Python dict:
-        {
-          "products": [...],
-          "summary_for_user": "..."
-        }
-        """
+    ) -> Tuple[str, str]:
         profile_text = self._profile_to_text(user_profile)
 
         system_prompt = (
@@ -123,6 +618,55 @@ class RealJsonFreigent:
             "Now generate the JSON response as specified. Remember: JSON only."
         )
 
+        return system_prompt, user_prompt
+
+    # ------------------------------------------------------------------
+    # Helper: turn an Anthropic response into the result dict
+    # ------------------------------------------------------------------
+    def _parse_response(self, response: Any) -> Dict[str, Any]:
+        # Anthropic returns a list of content blocks; we take the first text
+        raw_text = ""
+        if response.content and len(response.content) > 0:
+            # each item is usually {'type': 'text', 'text': '...'}
+            raw_text = response.content[0].text.strip()
+
+        return self._parse_text(raw_text)
+
+    def _parse_text(self, raw_text: str) -> Dict[str, Any]:
+        # Try to parse JSON
+        parsed = json.loads(raw_text.strip())
+
+        # Ensure the expected keys exist
+        if "products" not in parsed:
+            parsed["products"] = []
+        if "summary_for_user" not in parsed:
+            parsed["summary_for_user"] = (
+                "No summary_for_user provided by the model."
+            )
+
+        return parsed
+
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        # If anything fails (LLM error, JSON error, etc.), return a safe fallback
+        return {
+            "products": [],
+            "summary_for_user": (
+                "The agent tried to return a result, but there was an error "
+                "parsing the JSON output.\n\nError: " + str(e)
+            ),
+        }
+
+    # ------------------------------------------------------------------
+    # Helper: one LLM round-trip (run by the single-flight leader)
+    # ------------------------------------------------------------------
+    def _fetch_recommendations(
+        self,
+        key: str,
+        user_profile: Dict[str, Any],
+        query: str,
+    ) -> Dict[str, Any]:
+        system_prompt, user_prompt = self._build_prompts(user_profile, query)
+
         try:
             response = self.client.messages.create(
                 model=self.model_name,
@@ -135,32 +679,177 @@ class RealJsonFreigent:
                     }
                 ],
             )
+            parsed = self._parse_response(response)
 
-            # Anthropic returns a list of content blocks; we take the first text
-            raw_text = ""
-            if response.content and len(response.content) > 0:
-                # each item is usually {'type': 'text', 'text': '...'}
-                raw_text = response.content[0].text.strip()
-
-            # Try to parse JSON
-            parsed = json.loads(raw_text)
-
-            # Ensure the expected keys exist
-            if "products" not in parsed:
-                parsed["products"] = []
-            if "summary_for_user" not in parsed:
-                parsed["summary_for_user"] = (
-                    "No summary_for_user provided by the model."
-                )
+        except Exception as e:
+            return self._error_result(e)
+
+        self.cache.set(key, parsed)
+        return parsed
 
-            return parsed
+    async def _afetch_recommendations(
+        self,
+        key: str,
+        user_profile: Dict[str, Any],
+        query: str,
+    ) -> Dict[str, Any]:
+        system_prompt, user_prompt = self._build_prompts(user_profile, query)
+
+        try:
+            response = await self.async_client.messages.create(
+                model=self.model_name,
+                max_tokens=2048,
+                system=system_prompt,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": user_prompt,
+                    }
+                ],
+            )
+            parsed = self._parse_response(response)
 
         except Exception as e:
-            # If anything fails (LLM error, JSON error, etc.), return a safe fallback
-            return {
-                "products": [],
-                "summary_for_user": (
-                    "The agent tried to return a result, but there was an error "
-                    "parsing the JSON output.\n\nError: " + str(e)
-                ),
-            }
+            return self._error_result(e)
+
+        await self.cache.aset(key, parsed)
+        return parsed
+
+    # ------------------------------------------------------------------
+    # Main method: generate JSON recommendations
+    # ------------------------------------------------------------------
+    def cache_key(self, user_profile: Dict[str, Any], query: str) -> str:
+        return make_cache_key(
+            self._profile_to_text(user_profile), query, self.model_name
+        )
+
+    def generate_recommendations_json(
+        self,
+        user_profile: Dict[str, Any],
+        query: str,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Calls Anthropic and asks it to return ONLY valid JSON with
+        a list of products and a summary_for_user.
+
+        Results are served from / stored in the recommendation cache
+        unless use_cache=False. Error fallbacks are never cached.
+        Identical requests already in flight are joined instead of
+        triggering a second LLM call.
+
+        Returns a Python dict:
+        {
+          "products": [...],
+          "summary_for_user": "..."
+        }
+        """
+        key = self.cache_key(user_profile, query)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        return self.flights.do(
+            key, lambda: self._fetch_recommendations(key, user_profile, query)
+        )
+
+    async def agenerate_recommendations_json(
+        self,
+        user_profile: Dict[str, Any],
+        query: str,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Async counterpart of generate_recommendations_json, built on
+        AsyncAnthropic. Same prompt, same return shape, same cache,
+        single-flight and fallback on errors - but it never blocks the
+        event loop while waiting on the LLM.
+        """
+        key = self.cache_key(user_profile, query)
+        if use_cache:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return cached
+
+        return await self.flights.ado(
+            key, lambda: self._afetch_recommendations(key, user_profile, query)
+        )
+
+    async def astream_recommendations(
+        self,
+        user_profile: Dict[str, Any],
+        query: str,
+        use_cache: bool = True,
+        max_products: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Token-streamed variant of agenerate_recommendations_json.
+
+        Yields ("product", product_dict) for each product as soon as its
+        closing brace has been generated, then exactly one
+        ("result", result_dict) with the same shape the non-streaming
+        call returns.
+
+        If max_products is set, generation is cancelled (the HTTP stream
+        is closed) once that many products have arrived; the result then
+        holds just those products and an empty summary.
+
+        Complete results are read from / written to the recommendation
+        cache like the non-streaming call (a cache hit replays its
+        products, cut at max_products the same way); stopped or failed
+        generations are never cached.
+        """
+        key = self.cache_key(user_profile, query)
+        if use_cache:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                products = cached.get("products", [])
+                if max_products is not None and len(products) > max_products:
+                    # same result as a generation stopped at max_products
+                    cached = {"products": products[:max_products], "summary_for_user": ""}
+                for product in cached["products"]:
+                    yield "product", product
+                yield "result", cached
+                return
+
+        system_prompt, user_prompt = self._build_prompts(user_profile, query)
+        parser = IncrementalProductParser()
+        products: List[Dict[str, Any]] = []
+        stopped_early = False
+
+        try:
+            async with self.async_client.messages.stream(
+                model=self.model_name,
+                max_tokens=2048,
+                system=system_prompt,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": user_prompt,
+                    }
+                ],
+            ) as stream:
+                async for text in stream.text_stream:
+                    for product in parser.feed(text):
+                        products.append(product)
+                        yield "product", product
+                        if max_products is not None and len(products) >= max_products:
+                            stopped_early = True
+                            break
+                    if stopped_early:
+                        # leaving the context manager closes the stream
+                        break
+
+            if stopped_early:
+                yield "result", {"products": products, "summary_for_user": ""}
+                return
+
+            parsed = self._parse_text(parser.text)
+
+        except Exception as e:
+            yield "result", self._error_result(e)
+            return
+
+        await self.cache.aset(key, parsed)
+        yield "result", parsed
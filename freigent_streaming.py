@@ -0,0 +1,51 @@
+import json
+from typing import Any, AsyncIterator, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+
+# Supported wire formats for streaming endpoints (?format=...)
+STREAM_MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def encode_event(event: str, data: Any, fmt: str = "sse") -> str:
+    """
+    Encode one stream event.
+
+    - sse:    "event: <event>\\ndata: <json>\\n\\n"
+    - ndjson: {"event": <event>, "data": <json>} on a single line
+    """
+    if fmt == "ndjson":
+        return json.dumps({"event": event, "data": data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def validate_stream_format(fmt: str) -> None:
+    """Raise a 400 for an unknown ?format=... (call before starting any work)."""
+    if fmt not in STREAM_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported stream format '{fmt}'. Use one of: {', '.join(STREAM_MEDIA_TYPES)}",
+        )
+
+
+def streaming_response(
+    events: AsyncIterator[Tuple[str, Any]], fmt: str = "sse"
+) -> StreamingResponse:
+    """Wrap an async iterator of (event, data) pairs as an SSE/NDJSON response."""
+    validate_stream_format(fmt)
+
+    async def body() -> AsyncIterator[str]:
+        async for event, data in events:
+            yield encode_event(event, data, fmt)
+
+    return StreamingResponse(
+        body(),
+        media_type=STREAM_MEDIA_TYPES[fmt],
+        # stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
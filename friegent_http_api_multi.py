@@ -1,14 +1,30 @@
+import asyncio
 import os
-import sqlite3
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
+from freigent_db import (
+    NEXT_PROFILE_SEQ_SQL,
+    db_bulk_ingest,
+    db_connection,
+    db_index_profile_terms,
+    db_load_profiles,
+    init_db,
+    parse_bulk_records,
+)
 from freigent_real_json import RealJsonFreigent
+from freigent_streaming import streaming_response, validate_stream_format
+from profile_index import PROFILE_INDEX
 
 
-DB_PATH = os.getenv("FREIGENT_DB_PATH", "freigent.db")
+# Per-agent deadline (seconds) for the concurrent self + friends fan-out.
+AGENT_TIMEOUT_SECONDS = float(os.getenv("FREIGENT_AGENT_TIMEOUT_SECONDS", "30"))
+# Profiles written per transaction by the bulk ingestion endpoint.
+BULK_BATCH_SIZE = int(os.getenv("FREIGENT_BULK_BATCH_SIZE", "5000"))
 
 app = FastAPI(title="Friegent HTTP API Multi-Agent")
 
@@ -18,99 +34,64 @@ app = FastAPI(title="Friegent HTTP API Multi-Agent")
 # -------------------------------------------------------------------
 
 
-def get_db_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def db_upsert_profile(user_id: str, profile: "UserProfile") -> int:
+    """Store the profile and its experiences; returns its new updated_seq."""
+    with db_connection() as conn:
+        cur = conn.cursor()
 
+        # upsert profile row
+        cur.execute(
+            f"""
+            INSERT INTO profiles (user_id, name, personality, values_text, updated_seq)
+            VALUES (?, ?, ?, ?, {NEXT_PROFILE_SEQ_SQL})
+            ON CONFLICT(user_id) DO UPDATE SET
+                name=excluded.name,
+                personality=excluded.personality,
+                values_text=excluded.values_text,
+                updated_seq=excluded.updated_seq
+            """,
+            (user_id, profile.name, profile.personality, profile.values),
+        )
 
-def init_db() -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
+        # delete old experiences
+        cur.execute("DELETE FROM experiences WHERE user_id = ?", (user_id,))
+
+        # insert new experiences
+        for exp in profile.experiences:
+            cur.execute(
+                """
+                INSERT INTO experiences (user_id, name, notes, rating)
+                VALUES (?, ?, ?, ?)
+                """,
+                (user_id, exp.name, exp.notes, exp.rating),
+            )
 
-    # Profiles table (one row per user)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS profiles (
-            user_id TEXT PRIMARY KEY,
-            name TEXT,
-            personality TEXT,
-            values_text TEXT
-        )
-        """
-    )
+        # keep the helper-ranking term index in the same transaction
+        db_index_profile_terms(conn, [(user_id, profile.dict())])
 
-    # Experiences table (many rows per user)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS experiences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            name TEXT,
-            notes TEXT,
-            rating INTEGER,
-            FOREIGN KEY (user_id) REFERENCES profiles (user_id)
-        )
-        """
-    )
+        row = cur.execute(
+            "SELECT updated_seq FROM profiles WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row["updated_seq"]
 
-    conn.commit()
-    conn.close()
-
-
-def db_upsert_profile(user_id: str, profile: "UserProfile") -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # upsert profile row
-    cur.execute(
-        """
-        INSERT INTO profiles (user_id, name, personality, values_text)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            name=excluded.name,
-            personality=excluded.personality,
-            values_text=excluded.values_text
-        """,
-        (user_id, profile.name, profile.personality, profile.values),
-    )
 
-    # delete old experiences
-    cur.execute("DELETE FROM experiences WHERE user_id = ?", (user_id,))
+def db_get_profile(user_id: str) -> Optional["UserProfile"]:
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # insert new experiences
-    for exp in profile.experiences:
         cur.execute(
-            """
-            INSERT INTO experiences (user_id, name, notes, rating)
-            VALUES (?, ?, ?, ?)
-            """,
-            (user_id, exp.name, exp.notes, exp.rating),
+            "SELECT user_id, name, personality, values_text FROM profiles WHERE user_id = ?",
+            (user_id,),
         )
+        row = cur.fetchone()
+        if not row:
+            return None
 
-    conn.commit()
-    conn.close()
-
-
-def db_get_profile(user_id: str) -> Optional["UserProfile"]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        "SELECT user_id, name, personality, values_text FROM profiles WHERE user_id = ?",
-        (user_id,),
-    )
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return None
-
-    cur.execute(
-        "SELECT name, notes, rating FROM experiences WHERE user_id = ? ORDER BY id ASC",
-        (user_id,),
-    )
-    exp_rows = cur.fetchall()
-    conn.close()
+        cur.execute(
+            "SELECT name, notes, rating FROM experiences WHERE user_id = ? ORDER BY id ASC",
+            (user_id,),
+        )
+        exp_rows = cur.fetchall()
 
     experiences: List[ProductExperience] = []
     for er in exp_rows:
@@ -131,64 +112,52 @@ def db_get_profile(user_id: str) -> Optional["UserProfile"]:
 
 
 def db_get_other_profiles(
-    user_id: str, limit: int = 3
+    user_id: str, limit: int = 3, profile: Optional[Dict[str, Any]] = None
 ) -> List[Dict[str, Any]]:
     """
     Return up to `limit` other users' profiles + experiences.
     Used as 'friends' for multi-agent recommendations.
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT user_id, name, personality, values_text
-        FROM profiles
-        WHERE user_id != ?
-        ORDER BY user_id ASC
-        LIMIT ?
-        """,
-        (user_id, limit),
-    )
-    rows = cur.fetchall()
 
-    results: List[Dict[str, Any]] = []
-    for row in rows:
-        other_id = row["user_id"]
-        cur.execute(
-            """
-            SELECT name, notes, rating
-            FROM experiences
-            WHERE user_id = ?
-            ORDER BY id ASC
-            """,
-            (other_id,),
-        )
-        exp_rows = cur.fetchall()
-        exps: List[Dict[str, Any]] = []
-        for er in exp_rows:
-            exps.append(
-                {
-                    "name": er["name"],
-                    "notes": er["notes"],
-                    "rating": er["rating"],
-                }
-            )
-
-        results.append(
-            {
-                "user_id": other_id,
-                "profile": {
-                    "name": row["name"] or "",
-                    "personality": row["personality"] or "",
-                    "values": row["values_text"] or "",
-                    "experiences": exps,
-                },
-            }
-        )
+    If `profile` (the main user's profile_dict) is given, the friends are
+    the most similar profiles according to PROFILE_INDEX; any remaining
+    slots are filled in user_id order.
 
-    conn.close()
-    return results
+    Profiles and experiences are fetched in one batch (db_load_profiles),
+    so the number of queries doesn't grow with `limit`.
+    """
+    other_ids: List[str] = []
+    if profile is not None:
+        other_ids = [
+            other_id
+            for other_id, _score in PROFILE_INDEX.similar(profile, limit, exclude=[user_id])
+        ]
+
+    if len(other_ids) < limit:
+        with db_connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT user_id
+                FROM profiles
+                WHERE user_id != ?
+                ORDER BY user_id ASC
+                LIMIT ?
+                """,
+                (user_id, limit + len(other_ids)),
+            ).fetchall()
+        chosen = set(other_ids)
+        for row in rows:
+            if len(other_ids) >= limit:
+                break
+            if row["user_id"] not in chosen:
+                other_ids.append(row["user_id"])
+
+    profiles = db_load_profiles(other_ids)
+
+    return [
+        {"user_id": other_id, "profile": profiles[other_id]}
+        for other_id in other_ids
+        if other_id in profiles
+    ]
 
 
 # -------------------------------------------------------------------
@@ -214,10 +183,25 @@ class ProfileUpsertRequest(BaseModel):
     profile: UserProfile
 
 
+class BulkRecordStatus(BaseModel):
+    index: int
+    user_id: Optional[str] = None
+    status: str  # "ok" or "error"
+    error: Optional[str] = None
+
+
+class BulkUpsertResponse(BaseModel):
+    total: int
+    num_ok: int
+    num_errors: int
+    results: List[BulkRecordStatus]
+
+
 class RecommendMultiRequest(BaseModel):
     user_id: str
     query: str
     num_friends: int = 3
+    use_cache: bool = True  # set False to force fresh LLM calls
 
 
 class ProductRecommendation(BaseModel):
@@ -243,6 +227,31 @@ class RecommendMultiResponse(BaseModel):
 CORE_FREIGENT = RealJsonFreigent(agent_id="freigent-core")
 
 
+def _to_recommendations(
+    raw_products: Any, source_user_id: str, source_kind: str
+) -> List[ProductRecommendation]:
+    """
+    Normalize the raw 'products' list returned by one agent, tagging each
+    product with where it came from. Bad entries are skipped.
+    """
+    products: List[ProductRecommendation] = []
+    for p in raw_products or []:
+        try:
+            products.append(
+                ProductRecommendation(
+                    name=p.get("name", ""),
+                    short_description=p.get("short_description", ""),
+                    why_match=p.get("why_match", ""),
+                    estimated_price_range=p.get("estimated_price_range", ""),
+                    source_user_id=source_user_id,
+                    source_kind=source_kind,
+                )
+            )
+        except Exception:
+            continue
+    return products
+
+
 # -------------------------------------------------------------------
 # Startup
 # -------------------------------------------------------------------
@@ -251,6 +260,13 @@ CORE_FREIGENT = RealJsonFreigent(agent_id="freigent-core")
 @app.on_event("startup")
 def on_startup() -> None:
     init_db()
+    # load the similarity index in the background, not in the first request
+    PROFILE_INDEX.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    PROFILE_INDEX.stop()
 
 
 # -------------------------------------------------------------------
@@ -259,19 +275,25 @@ def on_startup() -> None:
 
 
 @app.get("/health")
-def health() -> Dict[str, str]:
+async def health() -> Dict[str, str]:
     return {"status": "ok", "service": "friegent-http-api-multi"}
 
 
 @app.post("/api/profile")
-def upsert_profile(req: ProfileUpsertRequest) -> Dict[str, Any]:
+async def upsert_profile(req: ProfileUpsertRequest) -> Dict[str, Any]:
     """
     Create or update a user's profile in the DB.
 
     This is what ChatGPT should call (via a tool) to persist or update
     the user's profile based on the free-text description they gave.
     """
-    db_upsert_profile(req.user_id, req.profile)
+
+    def write() -> None:
+        seq = db_upsert_profile(req.user_id, req.profile)
+        PROFILE_INDEX.upsert(req.user_id, req.profile.dict(), seq=seq)
+
+    # sqlite writes block; keep them off the event loop
+    await run_in_threadpool(write)
     return {
         "status": "ok",
         "user_id": req.user_id,
@@ -279,9 +301,42 @@ def upsert_profile(req: ProfileUpsertRequest) -> Dict[str, Any]:
     }
 
 
+@app.post("/api/profiles/bulk", response_model=BulkUpsertResponse)
+async def bulk_upsert_profiles(request: Request) -> BulkUpsertResponse:
+    """
+    Create or update many profiles in one call.
+
+    Body: NDJSON (one ProfileUpsertRequest object per line) or a JSON
+    array of ProfileUpsertRequest objects. Records are validated one by
+    one and written FREIGENT_BULK_BATCH_SIZE at a time, each batch in a
+    single transaction. The response reports a status for every record,
+    so one bad line doesn't reject the whole upload.
+    """
+    try:
+        records = parse_bulk_records(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def to_item(record: Any) -> Tuple[str, Dict[str, Any]]:
+        req = ProfileUpsertRequest.parse_obj(record)
+        return req.user_id, req.profile.dict()
+
+    # Large uploads take a while to write; keep the event loop free
+    results = await run_in_threadpool(
+        db_bulk_ingest, records, to_item, BULK_BATCH_SIZE
+    )
+    num_ok = sum(1 for r in results if r["status"] == "ok")
+    return BulkUpsertResponse(
+        total=len(results),
+        num_ok=num_ok,
+        num_errors=len(results) - num_ok,
+        results=results,
+    )
+
+
 @app.get("/api/profile/{user_id}")
-def get_profile(user_id: str) -> Dict[str, Any]:
-    prof = db_get_profile(user_id)
+async def get_profile(user_id: str) -> Dict[str, Any]:
+    prof = await run_in_threadpool(db_get_profile, user_id)
     if not prof:
         raise HTTPException(status_code=404, detail=f"No profile found for user_id={user_id}")
     return {
@@ -290,17 +345,18 @@ def get_profile(user_id: str) -> Dict[str, Any]:
     }
 
 
-@app.post("/api/recommend_multi", response_model=RecommendMultiResponse)
-def recommend_multi(req: RecommendMultiRequest) -> RecommendMultiResponse:
+# (source_user_id, source_kind, freigent, profile_dict) for one agent to ask
+AgentJob = Tuple[str, str, RealJsonFreigent, Dict[str, Any]]
+
+
+def _plan_recommend_multi(
+    req: RecommendMultiRequest,
+) -> Tuple[List[str], List[AgentJob]]:
     """
-    Main multi-agent recommendation endpoint.
+    Steps 1-3 of recommend_multi: load the main profile, pick friend
+    profiles and decide which Freigent answers for each of them.
 
-    Flow:
-    1. Load main user's profile from DB.
-    2. Ask CORE_FREIGENT for recommendations for that user.
-    3. Look up other profiles in DB (other users) as 'friend Freigents'.
-    4. For each friend, call a separate RealJsonFreigent instance with that profile.
-    5. Merge everything and return products + combined summary + metadata.
+    Returns (friend_ids, jobs); the main user's job is always first.
     """
 
     # 1. Get main profile
@@ -311,71 +367,55 @@ def recommend_multi(req: RecommendMultiRequest) -> RecommendMultiResponse:
             detail=f"No profile found for user_id={req.user_id}. Please set profile first via /api/profile.",
         )
 
-    # 2. Main recommendations
-    main_result = CORE_FREIGENT.generate_recommendations_json(
-        user_profile=main_profile.dict(), query=req.query
+    # 2. Friend profiles (most similar users first)
+    friend_rows = db_get_other_profiles(
+        req.user_id, limit=max(0, req.num_friends), profile=main_profile.dict()
     )
-
-    main_products_raw = main_result.get("products", []) or []
-    main_summary = main_result.get("summary_for_user", "")
-
-    products: List[ProductRecommendation] = []
-
-    # Normalize main products
-    for p in main_products_raw:
-        try:
-            products.append(
-                ProductRecommendation(
-                    name=p.get("name", ""),
-                    short_description=p.get("short_description", ""),
-                    why_match=p.get("why_match", ""),
-                    estimated_price_range=p.get("estimated_price_range", ""),
-                    source_user_id=req.user_id,
-                    source_kind="self",
-                )
-            )
-        except Exception:
-            # Skip bad product entries
-            continue
-
-    # 3. Friend profiles
-    friend_rows = db_get_other_profiles(req.user_id, limit=max(0, req.num_friends))
     friend_ids: List[str] = []
 
+    # 3. One Freigent for the main user and one per friend
+    jobs: List[AgentJob] = [
+        (req.user_id, "self", CORE_FREIGENT, main_profile.dict())
+    ]
     for row in friend_rows:
         friend_id = row["user_id"]
         friend_ids.append(friend_id)
-        friend_profile_dict = row["profile"]
 
         # Create a dedicated Freigent for this friend
         friend_freigent = RealJsonFreigent(agent_id=f"freigent-{friend_id}")
+        jobs.append((friend_id, "friend", friend_freigent, row["profile"]))
 
-        try:
-            friend_result = friend_freigent.generate_recommendations_json(
-                user_profile=friend_profile_dict, query=req.query
-            )
-        except Exception:
-            # If the LLM fails for a friend, just skip that friend
+    return friend_ids, jobs
+
+
+def _merge_recommend_multi(
+    req: RecommendMultiRequest,
+    friend_ids: List[str],
+    jobs: List[AgentJob],
+    results: List[Any],
+) -> RecommendMultiResponse:
+    """
+    Step 4 of recommend_multi: merge per-agent results (in job order, so
+    'self' products come first) and build the combined summary.
+    A result that is an exception (LLM error / timeout) is skipped.
+    """
+    main_summary = ""
+    products: List[ProductRecommendation] = []
+
+    for (source_user_id, source_kind, _, _), result in zip(jobs, results):
+        if result is None or isinstance(result, BaseException):
+            # If the LLM fails or times out for an agent, just skip that agent
             continue
 
-        friend_products_raw = friend_result.get("products", []) or []
-
-        for p in friend_products_raw:
-            try:
-                products.append(
-                    ProductRecommendation(
-                        name=p.get("name", ""),
-                        short_description=p.get("short_description", ""),
-                        why_match=p.get("why_match", ""),
-                        estimated_price_range=p.get("estimated_price_range", ""),
-                        source_user_id=friend_id,
-                        source_kind="friend",
-                    )
-                )
-            except Exception:
-                continue
+        if source_kind == "self":
+            main_summary = result.get("summary_for_user", "")
+
+        products.extend(
+            _to_recommendations(
+                result.get("products", []), source_user_id, source_kind
+            )
+        )
 
-    # 4. Build combined summary
     if friend_ids:
         friend_line = (
             f"\n\nI also asked {len(friend_ids)} other Friegent agents "
@@ -401,3 +441,135 @@ def recommend_multi(req: RecommendMultiRequest) -> RecommendMultiResponse:
         summary_for_user=combined_summary,
         sources=sources_meta,
     )
+
+
+@app.post("/api/recommend_multi", response_model=RecommendMultiResponse)
+async def recommend_multi(req: RecommendMultiRequest) -> RecommendMultiResponse:
+    """
+    Main multi-agent recommendation endpoint.
+
+    Flow:
+    1. Load main user's profile from DB.
+    2. Look up other profiles in DB (other users) as 'friend Freigents'.
+    3. Ask CORE_FREIGENT (for the user) and a separate RealJsonFreigent per
+       friend for recommendations, all at the same time, each bounded by
+       AGENT_TIMEOUT_SECONDS.
+    4. Merge everything and return products + combined summary + metadata.
+    """
+    # profile reads and friend ranking hit sqlite: run them off the loop
+    friend_ids, jobs = await run_in_threadpool(_plan_recommend_multi, req)
+
+    # Dispatch every agent call concurrently, then merge once each has
+    # finished or hit its own timeout
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(
+                freigent.agenerate_recommendations_json(
+                    user_profile=profile,
+                    query=req.query,
+                    use_cache=req.use_cache,
+                ),
+                AGENT_TIMEOUT_SECONDS,
+            )
+            for _, _, freigent, profile in jobs
+        ),
+        return_exceptions=True,
+    )
+
+    return _merge_recommend_multi(req, friend_ids, jobs, results)
+
+
+@app.post("/api/recommend_multi/stream")
+async def recommend_multi_stream(
+    req: RecommendMultiRequest,
+    fmt: str = Query("sse", alias="format", description="'sse' (text/event-stream) or 'ndjson'"),
+    max_products_per_agent: Optional[int] = Query(
+        None, ge=1, description="Stop each agent's generation after this many products"
+    ),
+) -> StreamingResponse:
+    """
+    Streaming variant of /api/recommend_multi.
+
+    Every agent's LLM output is token-streamed and parsed incrementally,
+    so products go out while the model is still writing the rest.
+
+    Events:
+    - "product" for each product the moment it has been generated:
+      {"source_user_id", "source_kind", "product": ProductRecommendation}
+    - "agent_result" when one agent is done (fastest first):
+      {"source_user_id", "source_kind", "status": "ok" | "error",
+       "products": [ProductRecommendation...]}
+    - "summary" once all agents are done or timed out: the exact
+      RecommendMultiResponse that /api/recommend_multi would return.
+    """
+    validate_stream_format(fmt)
+    friend_ids, jobs = await run_in_threadpool(_plan_recommend_multi, req)
+    queue: "asyncio.Queue[Tuple[int, str, Any]]" = asyncio.Queue()
+
+    async def pump(index: int) -> None:
+        _, _, freigent, profile = jobs[index]
+
+        async def run() -> None:
+            async for kind, data in freigent.astream_recommendations(
+                user_profile=profile,
+                query=req.query,
+                use_cache=req.use_cache,
+                max_products=max_products_per_agent,
+            ):
+                await queue.put((index, kind, data))
+
+        try:
+            await asyncio.wait_for(run(), AGENT_TIMEOUT_SECONDS)
+        except Exception as e:
+            await queue.put((index, "error", e))
+
+    async def events() -> AsyncIterator[Tuple[str, Any]]:
+        tasks = [asyncio.ensure_future(pump(i)) for i in range(len(jobs))]
+        results: List[Any] = [None] * len(jobs)
+        pending = len(jobs)
+        try:
+            while pending:
+                index, kind, data = await queue.get()
+                source_user_id, source_kind, _, _ = jobs[index]
+
+                if kind == "product":
+                    for p in _to_recommendations([data], source_user_id, source_kind):
+                        yield "product", {
+                            "source_user_id": source_user_id,
+                            "source_kind": source_kind,
+                            "product": p.dict(),
+                        }
+                    continue
+
+                pending -= 1
+                results[index] = data
+                if kind == "error":
+                    yield "agent_result", {
+                        "source_user_id": source_user_id,
+                        "source_kind": source_kind,
+                        "status": "error",
+                        "error": str(data) or type(data).__name__,
+                        "products": [],
+                    }
+                    continue
+
+                yield "agent_result", {
+                    "source_user_id": source_user_id,
+                    "source_kind": source_kind,
+                    "status": "ok",
+                    "products": [
+                        p.dict()
+                        for p in _to_recommendations(
+                            data.get("products", []), source_user_id, source_kind
+                        )
+                    ],
+                }
+
+            final = _merge_recommend_multi(req, friend_ids, jobs, results)
+            yield "summary", final.dict()
+        finally:
+            # client went away: don't leave LLM calls running for nobody
+            for task in tasks:
+                task.cancel()
+
+    return streaming_response(events(), fmt)
@@ -0,0 +1,690 @@
+# nanda_hub_server.py
+"""
+Standalone NandaHub process for multi-worker deployments.
+
+With `uvicorn --workers N` every worker imports its own nanda_hub.hub, so
+A2A messages sent in one worker never reach the others. Run one hub
+process instead and point the workers at it:
+
+    python nanda_hub_server.py --socket /tmp/nanda_hub.sock
+    NANDA_HUB_BACKEND=remote NANDA_HUB_SOCKET=/tmp/nanda_hub.sock uvicorn ... --workers 4
+
+Wire protocol (Unix domain socket): every frame is a 9-byte header
+struct ">IIB" (body length, request id, opcode / status) followed by a
+compact JSON body (payloads are arbitrary JSON objects either way, and
+the stdlib codec keeps the server free of extra dependencies). Requests
+carry an id chosen by the client and are answered with the same id, so a
+client can pipeline many requests on one connection; replies may come
+back out of order (a long-poll receive doesn't hold up the sends behind
+it).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from dataclasses import replace
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from nanda_hub import (
+    HANDOFF_LEASE,
+    OVERFLOW_BLOCK,
+    A2AMessage,
+    AgentRegistration,
+    InboxFull,
+    NandaHub,
+    create_hub,
+)
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">IIB")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# opcodes
+OP_REGISTER_AGENT = 1
+OP_GET_AGENT = 2
+OP_LIST_AGENTS = 3
+OP_DELIVER = 4
+OP_DELIVER_MANY = 5
+OP_SET_INBOX_LIMIT = 6
+OP_INBOX_LIMIT = 7
+OP_INBOX_STATS = 8
+OP_GET_INBOX = 9
+OP_TAKE = 10
+OP_ACK = 11
+OP_NACK = 12
+OP_TAKE_REPLIES = 13
+OP_INBOX_AGENT_IDS = 14
+OP_RECEIVE = 15
+OP_CANCEL = 16
+OP_SUBSCRIBE = 17
+OP_UNSUBSCRIBE = 18
+OP_SUBSCRIPTIONS = 19
+OP_PUBLISH = 20
+
+# reply status
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _frame(request_id: int, code: int, body: Any) -> bytes:
+    data = _dumps(body)
+    return HEADER.pack(len(data), request_id, code) + data
+
+
+# Messages / registrations travel as positional lists, not dicts
+def _msg_to_wire(msg: A2AMessage) -> list:
+    wire = [msg.message_id, msg.from_agent_id, msg.to_agent_id, dict(msg.payload), msg.expires_at]
+    if msg.lease_token is not None:
+        wire.append(msg.lease_token)
+    return wire
+
+
+def _msg_from_wire(data: Sequence[Any]) -> A2AMessage:
+    return A2AMessage(*data)
+
+
+def _batch_to_wire(msgs: Sequence[A2AMessage]) -> Tuple[list, list]:
+    """
+    A batch as (rows, payloads): each distinct payload object is encoded
+    once and rows refer to it by index, so a multicast of one payload to
+    N agents doesn't repeat it N times.
+    """
+    index: Dict[int, int] = {}
+    payloads: list = []
+    rows = []
+    for m in msgs:
+        i = index.get(id(m.payload))
+        if i is None:
+            i = index[id(m.payload)] = len(payloads)
+            payloads.append(dict(m.payload))
+        rows.append([m.message_id, m.from_agent_id, m.to_agent_id, i, m.expires_at])
+    return rows, payloads
+
+
+def _batch_from_wire(rows: Sequence[Sequence[Any]], payloads: list) -> List[A2AMessage]:
+    return [A2AMessage(mid, src, dst, payloads[i], exp) for mid, src, dst, i, exp in rows]
+
+
+def _reg_to_wire(reg: Optional[AgentRegistration]) -> Optional[list]:
+    if reg is None:
+        return None
+    return [reg.agent_id, reg.agent_type, reg.display_name, reg.personality_summary]
+
+
+def _reg_from_wire(data: Optional[Sequence[Any]]) -> Optional[AgentRegistration]:
+    return None if data is None else AgentRegistration(*data)
+
+
+def _error_to_wire(e: Exception) -> Dict[str, Any]:
+    if isinstance(e, InboxFull):
+        return {"type": "InboxFull", "agent_id": e.agent_id, "capacity": e.capacity}
+    return {"type": type(e).__name__, "message": str(e)}
+
+
+def _error_from_wire(data: Dict[str, Any]) -> Exception:
+    kind = data.get("type")
+    if kind == "InboxFull":
+        return InboxFull(data["agent_id"], data["capacity"])
+    if kind == "ValueError":
+        return ValueError(data.get("message", ""))
+    return RuntimeError(f"NandaHub server: {kind}: {data.get('message', '')}")
+
+
+# ----------------------------------------------------------------------
+# Server
+# ----------------------------------------------------------------------
+class NandaHubServer:
+    """
+    Serves one NandaHub to any number of RemoteNandaHub clients.
+
+    Requests are handled inline on the event loop, except receives (each
+    waits in its own task) and sends that may wait for room in a "block"
+    inbox. With `offload` (DurableNandaHub: every op is a SQLite
+    transaction) every request runs in the default executor instead, so
+    one slow commit doesn't stall the other clients. Each client waits for
+    its reply, so only requests sent without waiting (the ack / nack of a
+    remote areceive) may then be applied after later ones.
+    """
+
+    def __init__(self, hub: NandaHub, socket_path: str, offload: bool = False) -> None:
+        self.hub = hub
+        self.socket_path = socket_path
+        self.offload = offload
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        h = hub
+        # fast ops run inline on the event loop, in arrival order (unless offload)
+        self._ops: Dict[int, Callable[[list], Any]] = {
+            OP_REGISTER_AGENT: lambda a: _reg_to_wire(h.register_agent(*a)),
+            OP_GET_AGENT: lambda a: _reg_to_wire(h.get_agent(a[0])),
+            OP_LIST_AGENTS: lambda a: [_reg_to_wire(r) for r in h.list_agents()],
+            OP_SET_INBOX_LIMIT: lambda a: h.set_inbox_limit(*a),
+            OP_INBOX_LIMIT: lambda a: list(h.inbox_limit(a[0])),
+            OP_INBOX_STATS: lambda a: h.inbox_stats(a[0]),
+            OP_GET_INBOX: lambda a: [_msg_to_wire(m) for m in h.get_inbox(*a)],
+            OP_TAKE: lambda a: [_msg_to_wire(m) for m in h.take(*a)],
+            OP_ACK: lambda a: h.ack(*a),
+            OP_NACK: lambda a: h.nack(*a),
+            OP_TAKE_REPLIES: lambda a: [_msg_to_wire(m) for m in h.take_replies(*a)],
+            OP_INBOX_AGENT_IDS: lambda a: h.inbox_agent_ids(*a),
+            OP_SUBSCRIBE: lambda a: h.subscribe(*a),
+            OP_UNSUBSCRIBE: lambda a: h.unsubscribe(*a),
+            OP_SUBSCRIPTIONS: lambda a: h.subscriptions(*a),
+        }
+
+    async def start(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.socket_path)
+        logger.info("NandaHub server listening on %s", self.socket_path)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        assert self._server is not None
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks: Dict[int, "asyncio.Task[None]"] = {}
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                length, request_id, op = HEADER.unpack(header)
+                if length > MAX_FRAME_SIZE:
+                    logger.warning("NandaHub server: dropping client, frame of %d bytes", length)
+                    break
+                args = json.loads(await reader.readexactly(length))
+
+                if op == OP_CANCEL:
+                    task = tasks.get(args[0])
+                    if task is not None:
+                        task.cancel()
+                    continue
+                if (
+                    self.offload
+                    or op in (OP_RECEIVE, OP_PUBLISH)
+                    or (op in (OP_DELIVER, OP_DELIVER_MANY) and self._may_block(op, args))
+                ):
+                    task = asyncio.ensure_future(self._reply_later(writer, request_id, op, args))
+                    tasks[request_id] = task
+                    task.add_done_callback(lambda _, rid=request_id: tasks.pop(rid, None))
+                    continue
+
+                try:
+                    frame = _frame(request_id, STATUS_OK, self._run(op, args))
+                except Exception as e:
+                    frame = _frame(request_id, STATUS_ERROR, _error_to_wire(e))
+                writer.write(frame)
+                if writer.transport.get_write_buffer_size() > 256 * 1024:
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    def _may_block(self, op: int, args: list) -> bool:
+        # only the "block" overflow policy waits for room; keep it off the loop
+        msgs = [args[0]] if op == OP_DELIVER else args[0]
+        return any(self.hub.inbox_limit(m[2])[1] == OVERFLOW_BLOCK for m in msgs)
+
+    def _run(self, op: int, args: list) -> Any:
+        if op == OP_DELIVER:
+            return self._deliver(args)
+        if op == OP_DELIVER_MANY:
+            return self._deliver_many(args)
+        return self._ops[op](args)
+
+    def _deliver(self, args: list) -> None:
+        self.hub.deliver(_msg_from_wire(args[0]), args[1])
+
+    def _deliver_many(self, args: list) -> List[int]:
+        """Deliver a batch; returns the indexes of the messages refused."""
+        msgs = _batch_from_wire(args[0], args[1])
+        delivered = {m.message_id for m in self.hub.deliver_many(msgs, args[2])}
+        return [i for i, m in enumerate(msgs) if m.message_id not in delivered]
+
+    async def _reply_later(
+        self, writer: asyncio.StreamWriter, request_id: int, op: int, args: list
+    ) -> None:
+        try:
+            if op == OP_RECEIVE:
+                msgs = await self.hub.areceive(*args)
+                result: Any = [_msg_to_wire(m) for m in msgs]
+            elif op == OP_PUBLISH:
+                # recipients aren't known up front: any of them may "block"
+                msgs = await asyncio.to_thread(self.hub.publish, *args)
+                result = [_msg_to_wire(m) for m in msgs]
+            else:
+                result = await asyncio.to_thread(self._run, op, args)
+            frame = _frame(request_id, STATUS_OK, result)
+        except asyncio.CancelledError:
+            # the client stops waiting for a reply once it knows none is coming
+            if not writer.is_closing():
+                writer.write(
+                    _frame(request_id, STATUS_ERROR, {"type": "CancelledError", "message": ""})
+                )
+            raise
+        except Exception as e:
+            frame = _frame(request_id, STATUS_ERROR, _error_to_wire(e))
+        if not writer.is_closing():
+            writer.write(frame)
+
+
+# ----------------------------------------------------------------------
+# Client
+# ----------------------------------------------------------------------
+class _Call:
+    """A request waiting for its reply (from a thread or a coroutine)."""
+
+    __slots__ = ("event", "future", "ok", "result", "abandon")
+
+    def __init__(
+        self,
+        future: "Optional[asyncio.Future[Any]]" = None,
+        abandon: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        self.event = None if future is not None else threading.Event()
+        self.future = future
+        self.ok = False
+        self.result: Any = None
+        # gets the result if it comes after the caller has given up on it
+        self.abandon = abandon
+
+
+def _settle(call: _Call, ok: bool, result: Any) -> None:
+    fut = call.future
+    assert fut is not None
+    if fut.done():
+        if ok and call.abandon is not None:
+            call.abandon(result)  # the caller was cancelled meanwhile
+        return
+    if ok:
+        fut.set_result(result)
+    else:
+        fut.set_exception(result)
+
+
+class RemoteNandaHub(NandaHub):
+    """
+    NandaHub client for a hub served by nanda_hub_server.py.
+
+    One Unix socket per process, shared by all threads and coroutines:
+    requests are written as they come (pipelined) and a reader thread
+    hands each reply to whoever is waiting for it. The connection is
+    opened lazily, so a client created before uvicorn forks its workers
+    connects once per worker, and re-opened after the server restarts.
+
+    Listeners run in this process, for the messages sent through this
+    client (like DurableNandaHub); the A2AWorkerPool sweeps the hub every
+    `poll_interval` seconds for messages sent by other workers.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        poll_interval: float = 0.2,
+        connect_timeout: float = 5.0,
+        **hub_kwargs: Any,
+    ) -> None:
+        super().__init__(num_shards=1, **hub_kwargs)
+        self.socket_path = socket_path
+        self.poll_interval = float(poll_interval)
+        self.connect_timeout = float(connect_timeout)
+
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._pid: Optional[int] = None
+        self._next_id = 0
+        self._pending: Dict[int, _Call] = {}
+        # cancelled requests whose reply may still come back with a result
+        self._abandoned: Dict[int, Callable[[Any], None]] = {}
+
+    # ---------- Connection ----------
+
+    def _connect_locked(self) -> socket.socket:
+        if self._sock is not None and self._pid == os.getpid():
+            return self._sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        sock.connect(self.socket_path)
+        sock.settimeout(None)
+        self._sock, self._pid = sock, os.getpid()
+        self._pending = {}
+        self._abandoned = {}
+        threading.Thread(
+            target=self._read_loop, args=(sock,), name="nanda-hub-client", daemon=True
+        ).start()
+        return sock
+
+    def close(self) -> None:
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _read_loop(self, sock: socket.socket) -> None:
+        stream = sock.makefile("rb")
+        error: Exception = ConnectionError("NandaHub server closed the connection")
+        try:
+            while True:
+                header = stream.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, request_id, status = HEADER.unpack(header)
+                body = stream.read(length)
+                if len(body) < length:
+                    break
+                with self._lock:
+                    call = self._pending.pop(request_id, None)
+                    abandon = self._abandoned.pop(request_id, None)
+                if call is None:
+                    # cancelled (or no reply expected)
+                    if abandon is not None and status == STATUS_OK:
+                        abandon(json.loads(body))
+                    continue
+                data = json.loads(body)
+                if status == STATUS_OK:
+                    self._finish(call, True, data)
+                else:
+                    self._finish(call, False, _error_from_wire(data))
+        except (OSError, ValueError) as e:
+            error = ConnectionError(f"NandaHub connection lost: {e}")
+        finally:
+            stream.close()
+            with self._lock:
+                if self._sock is sock:
+                    self._sock = None
+                    pending, self._pending = self._pending, {}
+                else:
+                    pending = {}
+            for call in pending.values():
+                self._finish(call, False, error)
+
+    @staticmethod
+    def _finish(call: _Call, ok: bool, result: Any) -> None:
+        call.ok, call.result = ok, result
+        if call.future is not None:
+            try:
+                call.future.get_loop().call_soon_threadsafe(_settle, call, ok, result)
+            except RuntimeError:
+                pass  # caller's event loop is already closed
+        else:
+            assert call.event is not None
+            call.event.set()
+
+    def _submit(self, op: int, args: list, call: Optional[_Call]) -> int:
+        """Send one request; its reply goes to `call` (None: no reply expected)."""
+        with self._lock:
+            sock = self._connect_locked()
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            request_id = self._next_id
+            if call is not None:
+                self._pending[request_id] = call
+            try:
+                sock.sendall(_frame(request_id, op, args))
+            except OSError as e:
+                self._pending.pop(request_id, None)
+                self._sock = None
+                raise ConnectionError(f"NandaHub server unreachable: {e}") from e
+        return request_id
+
+    def _call(self, op: int, *args: Any) -> Any:
+        call = _Call()
+        self._submit(op, list(args), call)
+        assert call.event is not None
+        call.event.wait()
+        if not call.ok:
+            raise call.result
+        return call.result
+
+    async def _acall(
+        self, op: int, *args: Any, abandon: Optional[Callable[[Any], None]] = None
+    ) -> Any:
+        """
+        Await the reply. If cancelled, the result the server may still send
+        (or that came in just before) goes to `abandon`.
+        """
+        fut: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        request_id = self._submit(op, list(args), _Call(fut, abandon))
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                waiting = self._pending.pop(request_id, None) is not None
+                if waiting and abandon is not None:
+                    self._abandoned[request_id] = abandon
+            if waiting:
+                try:
+                    # stop the server from taking messages nobody will read
+                    self._submit(OP_CANCEL, [request_id], None)
+                except (ConnectionError, OSError):
+                    pass
+            elif abandon is not None and fut.done() and not fut.cancelled():
+                if fut.exception() is None:
+                    abandon(fut.result())  # the reply came, we were cancelled first
+            raise
+
+    # ---------- Agent registration ----------
+
+    def register_agent(
+        self,
+        agent_id: str,
+        agent_type: str,
+        display_name: str,
+        personality_summary: str = "",
+    ) -> AgentRegistration:
+        data = self._call(OP_REGISTER_AGENT, agent_id, agent_type, display_name, personality_summary)
+        return _reg_from_wire(data)
+
+    def get_agent(self, agent_id: str) -> Optional[AgentRegistration]:
+        return _reg_from_wire(self._call(OP_GET_AGENT, agent_id))
+
+    def list_agents(self) -> List[AgentRegistration]:
+        return [_reg_from_wire(r) for r in self._call(OP_LIST_AGENTS)]
+
+    # ---------- A2A messaging ----------
+
+    def deliver(self, msg: A2AMessage, block_timeout: Optional[float] = None) -> A2AMessage:
+        if self._resolve_reply(msg):
+            return msg
+        self._call(OP_DELIVER, _msg_to_wire(msg), block_timeout)
+        self._notify_listeners(msg)
+        return msg
+
+    async def adeliver(self, msg: A2AMessage) -> A2AMessage:
+        if self._resolve_reply(msg):
+            return msg
+        # the server may wait for a DB commit: don't hold the loop meanwhile
+        await self._acall(OP_DELIVER, _msg_to_wire(msg), 0)
+        self._notify_listeners(msg)
+        return msg
+
+    def deliver_many(
+        self, msgs: List[A2AMessage], block_timeout: Optional[float] = None
+    ) -> List[A2AMessage]:
+        """deliver() for a batch, in one round trip."""
+        remote = [m for m in msgs if not self._resolve_reply(m)]
+        if remote:
+            rows, payloads = _batch_to_wire(remote)
+            refused_at = self._call(OP_DELIVER_MANY, rows, payloads, block_timeout)
+            refused = {remote[i].message_id for i in refused_at}
+            for msg in remote:
+                if msg.message_id not in refused:
+                    self._notify_listeners(msg)
+            msgs = [m for m in msgs if m.message_id not in refused]
+        return msgs
+
+    # ---------- Topics (pub/sub) ----------
+    # Routed by the server; published messages skip this client's listeners.
+
+    def subscribe(self, agent_id: str, topic: str, group: Optional[str] = None) -> None:
+        self._call(OP_SUBSCRIBE, agent_id, topic, group)
+
+    def unsubscribe(self, agent_id: str, topic: str, group: Optional[str] = None) -> bool:
+        return self._call(OP_UNSUBSCRIBE, agent_id, topic, group)
+
+    def subscriptions(self, topic: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self._call(OP_SUBSCRIPTIONS, topic)
+
+    def publish(
+        self,
+        from_agent_id: str,
+        topic: str,
+        payload: Mapping[str, Any],
+        ttl: Optional[float] = None,
+        block_timeout: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        ttl = self.default_ttl if ttl is None else ttl
+        data = self._call(OP_PUBLISH, from_agent_id, topic, dict(payload), ttl, block_timeout)
+        return [_msg_from_wire(m) for m in data]
+
+    # ---------- Limits & stats ----------
+
+    def set_inbox_limit(self, agent_id: str, capacity: int, overflow: Optional[str] = None) -> None:
+        self._call(OP_SET_INBOX_LIMIT, agent_id, capacity, overflow)
+
+    def inbox_limit(self, agent_id: str) -> Tuple[int, str]:
+        capacity, policy = self._call(OP_INBOX_LIMIT, agent_id)
+        return capacity, policy
+
+    def inbox_stats(self, agent_id: str) -> Dict[str, Any]:
+        return self._call(OP_INBOX_STATS, agent_id)
+
+    # ---------- Reading ----------
+
+    def get_inbox(
+        self,
+        agent_id: str,
+        clear: bool = True,
+        payload_type: Optional[str] = None,
+    ) -> List[A2AMessage]:
+        return [_msg_from_wire(m) for m in self._call(OP_GET_INBOX, agent_id, clear, payload_type)]
+
+    def take(
+        self,
+        agent_id: str,
+        max_messages: Optional[int] = None,
+        payload_type: Optional[str] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        data = self._call(OP_TAKE, agent_id, max_messages, payload_type, lease)
+        return [_msg_from_wire(m) for m in data]
+
+    def ack(self, agent_id: str, message_ids: Iterable[str], lease_token: str) -> int:
+        return self._call(OP_ACK, agent_id, list(message_ids), lease_token)
+
+    def nack(self, agent_id: str, message_ids: Iterable[str], lease_token: str) -> int:
+        return self._call(OP_NACK, agent_id, list(message_ids), lease_token)
+
+    def take_replies(self, agent_id: str, original_message_ids: Iterable[str]) -> List[A2AMessage]:
+        data = self._call(OP_TAKE_REPLIES, agent_id, list(original_message_ids))
+        return [_msg_from_wire(m) for m in data]
+
+    def inbox_agent_ids(self, payload_type: Optional[str] = None) -> List[str]:
+        return self._call(OP_INBOX_AGENT_IDS, payload_type)
+
+    # ---------- Waiting receive ----------
+
+    def receive(
+        self,
+        agent_id: str,
+        timeout: Optional[float] = None,
+        payload_type: Optional[str] = None,
+        max_messages: Optional[int] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        data = self._call(OP_RECEIVE, agent_id, timeout, payload_type, max_messages, lease)
+        return [_msg_from_wire(m) for m in data]
+
+    async def areceive(
+        self,
+        agent_id: str,
+        timeout: Optional[float] = None,
+        payload_type: Optional[str] = None,
+        max_messages: Optional[int] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        # take under a lease until the messages are handed over, so the ones
+        # a cancelled areceive would drop on the floor go back to the inbox
+        handoff = lease is None
+        data = await self._acall(
+            OP_RECEIVE,
+            agent_id,
+            timeout,
+            payload_type,
+            max_messages,
+            HANDOFF_LEASE if handoff else lease,
+            abandon=lambda data: self._give_back(agent_id, data),
+        )
+        msgs = [_msg_from_wire(m) for m in data]
+        if msgs and handoff:
+            try:
+                # no reply needed: requests are handled in order
+                ids = [m.message_id for m in msgs]
+                self._submit(OP_ACK, [agent_id, ids, msgs[0].lease_token], None)
+            except ConnectionError:
+                pass  # the lease runs out and they are delivered again
+            msgs = [replace(m, lease_token=None) for m in msgs]
+        return msgs
+
+    def _give_back(self, agent_id: str, data: list) -> None:
+        """Requeue the messages of a receive the caller cancelled."""
+        msgs = [_msg_from_wire(m) for m in data]
+        if not msgs:
+            return
+        try:
+            ids = [m.message_id for m in msgs]
+            self._submit(OP_NACK, [agent_id, ids, msgs[0].lease_token], None)
+        except ConnectionError:
+            pass  # the lease runs out and they are delivered again
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Standalone NandaHub server (Unix socket)")
+    parser.add_argument(
+        "--socket", default=os.getenv("NANDA_HUB_SOCKET", "/tmp/nanda_hub.sock")
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["memory", "sqlite"],
+        default="memory",
+        help="hub served to the clients (sqlite: also survives restarts)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = NandaHubServer(
+        create_hub(args.backend), args.socket, offload=args.backend == "sqlite"
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
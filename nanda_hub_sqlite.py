@@ -0,0 +1,687 @@
+# nanda_hub_sqlite.py
+import asyncio
+import json
+import logging
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from dataclasses import replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from freigent_db import DB_PATH, IN_CHUNK_SIZE, get_pool, init_db
+from nanda_hub import (
+    HANDOFF_LEASE,
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_OLDEST,
+    A2AMessage,
+    AgentRegistration,
+    InboxFull,
+    NandaHub,
+    _check_topic,
+    _topic_prefixes,
+    _wake_all,
+)
+
+logger = logging.getLogger(__name__)
+
+_MESSAGE_COLUMNS = "seq, message_id, from_agent_id, to_agent_id, payload_json, expires_at"
+
+
+class _PendingSend:
+    """One send_message waiting for the writer thread to commit it."""
+
+    __slots__ = ("msg", "capacity", "policy", "done", "full", "error", "on_done")
+
+    def __init__(self, msg: A2AMessage, capacity: int, policy: str) -> None:
+        self.msg = msg
+        self.capacity = capacity
+        self.policy = policy
+        self.done = threading.Event()
+        self.full = False
+        self.error: Optional[BaseException] = None
+        # called by the writer thread once done is set (adeliver)
+        self.on_done: Optional[Callable[[], None]] = None
+
+
+def _set_done(fut: "asyncio.Future[None]") -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _row_to_message(row: sqlite3.Row, lease_token: Optional[str] = None) -> A2AMessage:
+    return A2AMessage(
+        message_id=row["message_id"],
+        from_agent_id=row["from_agent_id"],
+        to_agent_id=row["to_agent_id"],
+        payload=json.loads(row["payload_json"]),
+        expires_at=row["expires_at"],
+        lease_token=lease_token,
+    )
+
+
+def _chunks(items: Sequence[Any], size: int = IN_CHUNK_SIZE) -> Iterable[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class DurableNandaHub(NandaHub):
+    """
+    NandaHub whose agents and messages live in the Freigent SQLite DB
+    (tables a2a_agents / a2a_messages, WAL mode via the shared pool), so
+    queued A2A messages survive restarts and every uvicorn worker sees the
+    same inboxes.
+
+    - send_message hands the message to a single writer thread, which
+      commits whatever sends piled up meanwhile in ONE transaction (group
+      commit) before the senders return. Capacity / overflow checks run in
+      that transaction, so they hold across processes. Coroutines use
+      asend_message / asend_request, which await the commit instead of
+      blocking the event loop.
+    - Dequeue reads (to_agent_id, visible_at, seq) from an index. A leased
+      message just gets visible_at = now + lease and the take's
+      lease_token: if it isn't acked in time it becomes visible again
+      (visibility timeout), and once re-taken the old token no longer
+      acks it.
+    - receive/areceive are woken immediately by sends from this process
+      and poll every `poll_interval` seconds for sends from other ones.
+
+    Topic subscriptions and consumer-group round-robin cursors are tables
+    too, so every process publishes to the same subscribers.
+
+    Payloads are stored as JSON, so receivers get a copy. Listeners and
+    the rejected/dropped/expired counters stay per process.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        poll_interval: float = 0.2,
+        max_batch: int = 500,
+        **hub_kwargs: Any,
+    ) -> None:
+        super().__init__(**hub_kwargs)
+        self.db_path = db_path
+        self.poll_interval = float(poll_interval)
+        self.max_batch = max(1, int(max_batch))
+        self._pool = get_pool(db_path)
+        # the a2a_* tables are created by the schema migrations
+        init_db(db_path)
+
+        self._writes: "queue.Queue[_PendingSend]" = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="nanda-hub-writer", daemon=True
+        )
+        self._writer.start()
+
+    # ---------- Agent registration ----------
+
+    def register_agent(
+        self,
+        agent_id: str,
+        agent_type: str,
+        display_name: str,
+        personality_summary: str = "",
+    ) -> AgentRegistration:
+        reg = AgentRegistration(
+            agent_id=agent_id,
+            agent_type=agent_type,
+            display_name=display_name,
+            personality_summary=personality_summary,
+        )
+        with self._pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO a2a_agents (agent_id, agent_type, display_name, personality_summary)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(agent_id) DO UPDATE SET
+                    agent_type = excluded.agent_type,
+                    display_name = excluded.display_name,
+                    personality_summary = excluded.personality_summary
+                """,
+                (agent_id, agent_type, display_name, personality_summary),
+            )
+        return reg
+
+    def get_agent(self, agent_id: str) -> Optional[AgentRegistration]:
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                "SELECT * FROM a2a_agents WHERE agent_id = ?", (agent_id,)
+            ).fetchone()
+        return AgentRegistration(**dict(row)) if row else None
+
+    def list_agents(self) -> List[AgentRegistration]:
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT * FROM a2a_agents ORDER BY agent_id").fetchall()
+        return [AgentRegistration(**dict(row)) for row in rows]
+
+    # ---------- Topics (pub/sub) ----------
+
+    def subscribe(self, agent_id: str, topic: str, group: Optional[str] = None) -> None:
+        _check_topic(topic)
+        with self._pool.connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO a2a_subscriptions (topic, group_name, agent_id) VALUES (?, ?, ?)",
+                (topic, group or "", agent_id),
+            )
+
+    def unsubscribe(self, agent_id: str, topic: str, group: Optional[str] = None) -> bool:
+        with self._pool.connection() as conn:
+            return bool(
+                conn.execute(
+                    "DELETE FROM a2a_subscriptions WHERE topic = ? AND group_name = ? AND agent_id = ?",
+                    (topic, group or "", agent_id),
+                ).rowcount
+            )
+
+    def subscriptions(self, topic: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT topic, group_name, agent_id FROM a2a_subscriptions"
+        params: List[Any] = []
+        if topic is not None:
+            sql += " WHERE topic = ?"
+            params.append(topic)
+        sql += " ORDER BY topic, group_name, agent_id"
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {"topic": r["topic"], "group": r["group_name"] or None, "agent_id": r["agent_id"]}
+            for r in rows
+        ]
+
+    def _route(self, topic: str, exclude: str) -> Tuple[List[str], List[List[str]]]:
+        prefixes = _topic_prefixes(topic)
+        placeholders = ", ".join("?" for _ in prefixes)
+        direct: List[str] = []
+        seen: set = set()
+        groups: List[List[str]] = []
+        with self._pool.connection() as conn:
+            # the cursor update must be atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"""
+                SELECT topic, group_name, agent_id FROM a2a_subscriptions
+                WHERE topic IN ({placeholders}) AND agent_id != ?
+                ORDER BY length(topic), group_name, agent_id
+                """,
+                [*prefixes, exclude],
+            ).fetchall()
+
+            members: Dict[Tuple[str, str], List[str]] = {}
+            for r in rows:
+                members.setdefault((r["topic"], r["group_name"]), []).append(r["agent_id"])
+            for (t, group), candidates in members.items():
+                if not group:
+                    direct.extend(a for a in candidates if a not in seen)
+                    seen.update(candidates)
+                    continue
+                row = conn.execute(
+                    "SELECT next_index FROM a2a_group_cursors WHERE topic = ? AND group_name = ?",
+                    (t, group),
+                ).fetchone()
+                start = (row["next_index"] if row else 0) % len(candidates)
+                conn.execute(
+                    """
+                    INSERT INTO a2a_group_cursors (topic, group_name, next_index) VALUES (?, ?, ?)
+                    ON CONFLICT(topic, group_name) DO UPDATE SET next_index = excluded.next_index
+                    """,
+                    (t, group, start + 1),
+                )
+                groups.append(candidates[start:] + candidates[:start])
+        return direct, groups
+
+    # ---------- A2A messaging ----------
+
+    def deliver(self, msg: A2AMessage, block_timeout: Optional[float] = None) -> A2AMessage:
+        if self._resolve_reply(msg):
+            return msg
+        refused = self._persist([msg], block_timeout)
+        if refused:
+            raise InboxFull(msg.to_agent_id, refused[0].capacity)
+        self._notify_listeners(msg)
+        return msg
+
+    def deliver_many(
+        self, msgs: List[A2AMessage], block_timeout: Optional[float] = None
+    ) -> List[A2AMessage]:
+        queued = [m for m in msgs if not self._resolve_reply(m)]
+        refused = {p.msg.message_id for p in self._persist(queued, block_timeout)}
+        for msg in queued:
+            if msg.message_id not in refused:
+                self._notify_listeners(msg)  # committed: visible to take()
+        return [m for m in msgs if m.message_id not in refused]
+
+    async def adeliver(self, msg: A2AMessage) -> A2AMessage:
+        if self._resolve_reply(msg):
+            return msg
+        loop = asyncio.get_running_loop()
+        committed: "asyncio.Future[None]" = loop.create_future()
+
+        def on_done() -> None:
+            try:
+                loop.call_soon_threadsafe(_set_done, committed)
+            except RuntimeError:
+                pass  # caller's event loop is already closed
+
+        pending = _PendingSend(msg, *self.inbox_limit(msg.to_agent_id))
+        pending.on_done = on_done
+        self._writes.put(pending)
+        # the write goes ahead even if we are cancelled meanwhile
+        await asyncio.shield(committed)
+        if pending.error is not None:
+            raise pending.error
+        if pending.full:
+            shard = self._shard(msg.to_agent_id)
+            with shard.cond:
+                self._count(msg.to_agent_id, "rejected")
+            raise InboxFull(msg.to_agent_id, pending.capacity)
+        self._notify_listeners(msg)
+        return msg
+
+    def _persist(
+        self, msgs: List[A2AMessage], block_timeout: Optional[float]
+    ) -> List[_PendingSend]:
+        """
+        Hand msgs to the writer thread and wait until they are committed
+        (usually all in one transaction). Returns the sends refused because
+        the inbox stayed full.
+        """
+        timeout = self.block_timeout if block_timeout is None else block_timeout
+        deadline = time.monotonic() + timeout
+        refused: List[_PendingSend] = []
+        while msgs:
+            batch = [_PendingSend(m, *self.inbox_limit(m.to_agent_id)) for m in msgs]
+            for pending in batch:
+                self._writes.put(pending)
+            for pending in batch:
+                pending.done.wait()
+            for pending in batch:
+                if pending.error is not None:
+                    raise pending.error
+
+            remaining = deadline - time.monotonic()
+            msgs = []
+            for pending in batch:
+                if not pending.full:
+                    continue
+                if pending.policy == OVERFLOW_BLOCK and remaining > 0:
+                    msgs.append(pending.msg)
+                    continue
+                shard = self._shard(pending.msg.to_agent_id)
+                with shard.cond:
+                    self._count(pending.msg.to_agent_id, "rejected")
+                refused.append(pending)
+            if msgs:
+                # wait for a local drain (or poll for a remote one), then retry
+                shard = self._shard(msgs[0].to_agent_id)
+                with shard.cond:
+                    shard.cond.wait(min(self.poll_interval, remaining))
+        return refused
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except BaseException as e:
+                logger.exception("NandaHub writer: commit of %d messages failed", len(batch))
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+                    if pending.on_done is not None:
+                        pending.on_done()
+
+            delivered = {p.msg.to_agent_id for p in batch if p.error is None and not p.full}
+            for agent_id in delivered:
+                shard = self._shard(agent_id)
+                with shard.cond:
+                    waiters = self._notify_locked(shard, agent_id)
+                _wake_all(waiters)
+
+    def _commit(self, batch: List[_PendingSend]) -> None:
+        now = time.time()
+        sizes: Dict[str, int] = {}
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for pending in batch:
+                msg = pending.msg
+                to = msg.to_agent_id
+                if pending.capacity:
+                    size = sizes.get(to)
+                    if size is None:
+                        self._purge_expired(conn, to, now)
+                        size = self._queued_count(conn, to, now)
+                    if size >= pending.capacity:
+                        if pending.policy == OVERFLOW_DROP_OLDEST:
+                            excess = size - pending.capacity + 1
+                            conn.execute(
+                                """
+                                DELETE FROM a2a_messages WHERE seq IN (
+                                    SELECT seq FROM a2a_messages
+                                    WHERE to_agent_id = ? AND visible_at <= ?
+                                    ORDER BY seq LIMIT ?
+                                )
+                                """,
+                                (to, now, excess),
+                            )
+                            shard = self._shard(to)
+                            with shard.cond:
+                                self._count(to, "dropped", excess)
+                            size -= excess
+                        else:
+                            pending.full = True
+                            sizes[to] = size
+                            continue
+                    sizes[to] = size + 1
+
+                payload = msg.payload or {}
+                conn.execute(
+                    """
+                    INSERT INTO a2a_messages (
+                        message_id, from_agent_id, to_agent_id, payload_type,
+                        correlation_id, payload_json, expires_at, visible_at
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                    """,
+                    (
+                        msg.message_id,
+                        msg.from_agent_id,
+                        to,
+                        payload.get("type"),
+                        payload.get("original_message_id"),
+                        json.dumps(dict(payload)),
+                        msg.expires_at,
+                    ),
+                )
+
+    def _queued_count(self, conn: sqlite3.Connection, agent_id: str, now: float) -> int:
+        return conn.execute(
+            "SELECT COUNT(*) FROM a2a_messages WHERE to_agent_id = ? AND visible_at <= ?",
+            (agent_id, now),
+        ).fetchone()[0]
+
+    def _purge_expired(self, conn: sqlite3.Connection, agent_id: str, now: float) -> None:
+        expired = conn.execute(
+            """
+            DELETE FROM a2a_messages
+            WHERE to_agent_id = ? AND visible_at <= ?
+              AND expires_at IS NOT NULL AND expires_at <= ?
+            """,
+            (agent_id, now, now),
+        ).rowcount
+        if expired:
+            shard = self._shard(agent_id)
+            with shard.cond:
+                self._count(agent_id, "expired", expired)
+
+    def get_inbox(
+        self,
+        agent_id: str,
+        clear: bool = True,
+        payload_type: Optional[str] = None,
+    ) -> List[A2AMessage]:
+        return self._dequeue(agent_id, clear, payload_type)
+
+    def take(
+        self,
+        agent_id: str,
+        max_messages: Optional[int] = None,
+        payload_type: Optional[str] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        return self._dequeue(agent_id, True, payload_type, max_messages, lease)
+
+    def _dequeue(
+        self,
+        agent_id: str,
+        clear: bool,
+        payload_type: Optional[str],
+        max_messages: Optional[int] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        now = time.time()
+        sql = (
+            f"SELECT {_MESSAGE_COLUMNS} FROM a2a_messages "
+            "WHERE to_agent_id = ? AND visible_at <= ?"
+        )
+        params: List[Any] = [agent_id, now]
+        if payload_type is not None:
+            sql += " AND payload_type = ?"
+            params.append(payload_type)
+        sql += " ORDER BY seq"
+        if max_messages is not None:
+            sql += " LIMIT ?"
+            params.append(int(max_messages))
+
+        token = None if lease is None or not clear else secrets.token_hex(8)
+        with self._pool.connection() as conn:
+            if clear:
+                conn.execute("BEGIN IMMEDIATE")
+                self._purge_expired(conn, agent_id, now)
+            rows = conn.execute(sql, params).fetchall()
+            if clear and rows:
+                seqs = [row["seq"] for row in rows]
+                for chunk in _chunks(seqs):
+                    placeholders = ", ".join("?" for _ in chunk)
+                    if token is None:
+                        conn.execute(f"DELETE FROM a2a_messages WHERE seq IN ({placeholders})", chunk)
+                    else:
+                        conn.execute(
+                            f"""
+                            UPDATE a2a_messages SET visible_at = ?, lease_token = ?
+                            WHERE seq IN ({placeholders})
+                            """,
+                            [now + lease, token, *chunk],
+                        )
+
+        msgs = [_row_to_message(row, token) for row in rows]
+        if clear and not payload_type and msgs:
+            # room freed: wake local senders blocked on a full inbox
+            shard = self._shard(agent_id)
+            with shard.cond:
+                shard.cond.notify_all()
+        return msgs
+
+    def ack(self, agent_id: str, message_ids: Iterable[str], lease_token: str) -> int:
+        ids = list(message_ids)
+        acked = 0
+        with self._pool.connection() as conn:
+            for chunk in _chunks(ids):
+                placeholders = ", ".join("?" for _ in chunk)
+                acked += conn.execute(
+                    f"""
+                    DELETE FROM a2a_messages
+                    WHERE to_agent_id = ? AND visible_at > 0 AND lease_token = ?
+                      AND message_id IN ({placeholders})
+                    """,
+                    [agent_id, lease_token, *chunk],
+                ).rowcount
+        return acked
+
+    def nack(self, agent_id: str, message_ids: Iterable[str], lease_token: str) -> int:
+        ids = list(message_ids)
+        requeued = 0
+        with self._pool.connection() as conn:
+            for chunk in _chunks(ids):
+                placeholders = ", ".join("?" for _ in chunk)
+                requeued += conn.execute(
+                    f"""
+                    UPDATE a2a_messages SET visible_at = 0, lease_token = NULL
+                    WHERE to_agent_id = ? AND visible_at > 0 AND lease_token = ?
+                      AND message_id IN ({placeholders})
+                    """,
+                    [agent_id, lease_token, *chunk],
+                ).rowcount
+        if requeued:
+            shard = self._shard(agent_id)
+            with shard.cond:
+                waiters = self._notify_locked(shard, agent_id)
+            _wake_all(waiters)
+        return requeued
+
+    def take_replies(self, agent_id: str, original_message_ids: Iterable[str]) -> List[A2AMessage]:
+        ids = list(original_message_ids)
+        if not ids:
+            return []
+        now = time.time()
+        rows: List[sqlite3.Row] = []
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for chunk in _chunks(ids):
+                placeholders = ", ".join("?" for _ in chunk)
+                found = conn.execute(
+                    f"""
+                    SELECT {_MESSAGE_COLUMNS} FROM a2a_messages
+                    WHERE correlation_id IN ({placeholders})
+                      AND to_agent_id = ? AND visible_at <= ?
+                    """,
+                    [*chunk, agent_id, now],
+                ).fetchall()
+                rows.extend(found)
+                if found:
+                    seq_marks = ", ".join("?" for _ in found)
+                    conn.execute(
+                        f"DELETE FROM a2a_messages WHERE seq IN ({seq_marks})",
+                        [row["seq"] for row in found],
+                    )
+        rows.sort(key=lambda row: row["seq"])
+        return [_row_to_message(row) for row in rows]
+
+    def inbox_agent_ids(self, payload_type: Optional[str] = None) -> List[str]:
+        sql = "SELECT DISTINCT to_agent_id FROM a2a_messages WHERE visible_at <= ?"
+        params: List[Any] = [time.time()]
+        if payload_type is not None:
+            sql += " AND payload_type = ?"
+            params.append(payload_type)
+        with self._pool.connection() as conn:
+            return [row[0] for row in conn.execute(sql, params)]
+
+    def inbox_stats(self, agent_id: str) -> Dict[str, Any]:
+        capacity, policy = self.inbox_limit(agent_id)
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT
+                    COALESCE(SUM(visible_at <= ?), 0) AS size,
+                    COALESCE(SUM(visible_at > ?), 0) AS in_flight
+                FROM a2a_messages WHERE to_agent_id = ?
+                """,
+                (time.time(), time.time(), agent_id),
+            ).fetchone()
+        shard = self._shard(agent_id)
+        with shard.cond:
+            counters = dict(self._counters.get(agent_id, {}))
+        return {
+            "agent_id": agent_id,
+            "size": row["size"],
+            "in_flight": row["in_flight"],
+            "capacity": capacity,
+            "overflow": policy,
+            "rejected": counters.get("rejected", 0),
+            "dropped": counters.get("dropped", 0),
+            "expired": counters.get("expired", 0),
+        }
+
+    # ---------- Waiting receive ----------
+
+    def receive(
+        self,
+        agent_id: str,
+        timeout: Optional[float] = None,
+        payload_type: Optional[str] = None,
+        max_messages: Optional[int] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        shard = self._shard(agent_id)
+        while True:
+            msgs = self.take(agent_id, max_messages, payload_type, lease)
+            if msgs:
+                return msgs
+            wait = self.poll_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                wait = min(wait, remaining)
+            with shard.cond:
+                shard.cond.wait(wait)
+
+    async def _atake(
+        self,
+        agent_id: str,
+        max_messages: Optional[int],
+        payload_type: Optional[str],
+        lease: Optional[float],
+    ) -> List[A2AMessage]:
+        loop = asyncio.get_running_loop()
+        handoff = lease is None
+        task = asyncio.ensure_future(
+            asyncio.to_thread(
+                self.take, agent_id, max_messages, payload_type, HANDOFF_LEASE if handoff else lease
+            )
+        )
+        try:
+            msgs = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # cancelled while the take runs: give back whatever it gets
+            def give_back(t: "asyncio.Future[List[A2AMessage]]") -> None:
+                taken = [] if t.cancelled() or t.exception() else t.result()
+                if taken:
+                    ids = [m.message_id for m in taken]
+                    loop.run_in_executor(None, self.nack, agent_id, ids, taken[0].lease_token)
+
+            task.add_done_callback(give_back)
+            raise
+        if msgs and handoff:
+            # nothing can cancel us past this point: finish the handoff
+            # without waiting for it
+            ids = [m.message_id for m in msgs]
+            loop.run_in_executor(None, self.ack, agent_id, ids, msgs[0].lease_token)
+            msgs = [replace(m, lease_token=None) for m in msgs]
+        return msgs
+
+    async def areceive(
+        self,
+        agent_id: str,
+        timeout: Optional[float] = None,
+        payload_type: Optional[str] = None,
+        max_messages: Optional[int] = None,
+        lease: Optional[float] = None,
+    ) -> List[A2AMessage]:
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        shard = self._shard(agent_id)
+        while True:
+            # a write transaction: run it off the event loop
+            msgs = await self._atake(agent_id, max_messages, payload_type, lease)
+            if msgs:
+                return msgs
+            wait = self.poll_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                wait = min(wait, remaining)
+
+            fut: "asyncio.Future[None]" = loop.create_future()
+            with shard.cond:
+                shard.async_waiters.setdefault(agent_id, []).append(fut)
+            try:
+                await asyncio.wait_for(fut, wait)
+            except asyncio.TimeoutError:
+                pass  # poll again: the message may come from another process
+            finally:
+                with shard.cond:
+                    waiters = shard.async_waiters.get(agent_id)
+                    if waiters and fut in waiters:
+                        waiters.remove(fut)
+                        if not waiters:
+                            del shard.async_waiters[agent_id]
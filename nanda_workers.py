@@ -0,0 +1,216 @@
+# nanda_workers.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Union
+
+from nanda_hub import A2AMessage, NandaHub
+
+logger = logging.getLogger(__name__)
+
+# handler(agent_id, messages) processes a batch taken from one agent's inbox
+A2AHandler = Callable[[str, List[A2AMessage]], Awaitable[Any]]
+
+
+class A2AWorkerPool:
+    """
+    Background consumers for NandaHub inboxes.
+
+    - Every message of `request_type` sent through the hub schedules its
+      recipient; one of `num_workers` asyncio workers then takes up to
+      `batch_size` of that agent's pending requests from the inbox (leased
+      for `lease_seconds`) and hands them to `handler`. The batch is acked
+      when the handler returns and given back (nack) if it fails or the
+      pool stops (stop() returns once those nacks are done); a failed
+      batch is retried after `retry_delay` seconds.
+      A full batch re-schedules the agent, so big backlogs are
+      worked off batch by batch, and different agents are served in parallel.
+    - Requesters wait for the answers with hub.send_request() /
+      hub.asend_request().
+    - With a hub shared between processes (DurableNandaHub), requests sent
+      by another process don't reach our listener. Set `poll_interval` to
+      sweep the hub for them every so many seconds.
+
+    start() / stop() must be called from the event loop that serves the
+    requests (e.g. FastAPI startup / shutdown). The hub may be used from
+    other threads; listener callbacks hop onto the loop thread.
+    """
+
+    def __init__(
+        self,
+        hub: NandaHub,
+        handler: A2AHandler,
+        num_workers: int = 4,
+        request_type: str = "recommendation_request",
+        batch_size: int = 10,
+        lease_seconds: float = 300.0,
+        poll_interval: Optional[float] = None,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.hub = hub
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.request_type = request_type
+        self.batch_size = max(1, int(batch_size))
+        self.lease_seconds = float(lease_seconds)
+        self.poll_interval = poll_interval
+        self.retry_delay = float(retry_delay)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: "Optional[asyncio.Queue[str]]" = None
+        self._scheduled: Set[str] = set()
+        self._workers: List["asyncio.Task[None]"] = []
+        # nacks of cancelled batches; stop() waits for them
+        self._giving_back: Set["asyncio.Future[None]"] = set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        self.hub.add_listener(self._on_message)
+        if self.poll_interval:
+            self._workers.append(asyncio.create_task(self._sweeper()))
+
+        # requests that arrived before the pool started
+        for agent_id in self.hub.inbox_agent_ids(payload_type=self.request_type):
+            self._schedule(agent_id)
+
+    async def stop(self) -> None:
+        self.hub.remove_listener(self._on_message)
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # release the leases before returning, not lease_seconds later
+        await asyncio.gather(*self._giving_back, return_exceptions=True)
+        self._scheduled.clear()
+
+    # ------------------------------------------------------------------
+    # Hub listener (may run on any thread)
+    # ------------------------------------------------------------------
+    def _on_message(self, msg: A2AMessage) -> None:
+        # msg is already in the inbox, so the worker's take() will find it
+        if (msg.payload or {}).get("type") == self.request_type:
+            self._call_in_loop(self._schedule, msg.to_agent_id)
+
+    def _call_in_loop(self, fn: Callable[..., Any], *args: Any) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            fn(*args)
+        else:
+            loop.call_soon_threadsafe(fn, *args)
+
+    def _schedule(self, agent_id: str) -> None:
+        if not self.running or self._queue is None or agent_id in self._scheduled:
+            return
+        self._scheduled.add(agent_id)
+        self._queue.put_nowait(agent_id)
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+    async def _worker(self, index: int) -> None:
+        assert self._queue is not None
+        while True:
+            agent_id = await self._queue.get()
+            # unmark first: requests arriving while we work re-schedule the agent
+            self._scheduled.discard(agent_id)
+            msgs = await self._take(agent_id)
+            if not msgs:
+                continue
+            if len(msgs) == self.batch_size:
+                # maybe more queued: let the next free worker take another batch
+                self._schedule(agent_id)
+
+            message_ids = [m.message_id for m in msgs]
+            token = msgs[0].lease_token
+            try:
+                await self.handler(agent_id, msgs)
+            except asyncio.CancelledError:
+                # shielded: cancelling the worker again must not drop the nack
+                await asyncio.shield(self._give_back(agent_id, msgs))
+                raise
+            except Exception:
+                logger.exception("A2A worker %d: handler failed for agent %s", index, agent_id)
+                # back in the inbox; retry even if no new request arrives
+                await asyncio.to_thread(self.hub.nack, agent_id, message_ids, token)
+                asyncio.get_running_loop().call_later(
+                    self.retry_delay, self._schedule, agent_id
+                )
+            else:
+                await asyncio.to_thread(self.hub.ack, agent_id, message_ids, token)
+
+    async def _take(self, agent_id: str) -> List[A2AMessage]:
+        # hub calls may do disk I/O (DurableNandaHub): run them off the loop
+        task = asyncio.ensure_future(
+            asyncio.to_thread(
+                self.hub.take,
+                agent_id,
+                self.batch_size,
+                payload_type=self.request_type,
+                lease=self.lease_seconds,
+            )
+        )
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # stopped meanwhile: give back whatever the take gets
+            self._give_back(agent_id, task)
+            raise
+
+    def _give_back(
+        self,
+        agent_id: str,
+        taken: "Union[List[A2AMessage], asyncio.Future[List[A2AMessage]]]",
+    ) -> "asyncio.Future[None]":
+        """Nack `taken` (or what the take it is gets) in a thread; stop() waits for it."""
+
+        async def nack() -> None:
+            try:
+                msgs = await taken if isinstance(taken, asyncio.Future) else taken
+                if msgs:
+                    await asyncio.to_thread(
+                        self.hub.nack,
+                        agent_id,
+                        [m.message_id for m in msgs],
+                        msgs[0].lease_token,
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("A2A worker: could not give back the batch of agent %s", agent_id)
+
+        fut = asyncio.ensure_future(nack())
+        self._giving_back.add(fut)
+        fut.add_done_callback(self._giving_back.discard)
+        return fut
+
+    async def _sweeper(self) -> None:
+        """Pick up requests that other processes put in the hub."""
+        assert self.poll_interval
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                agent_ids = await asyncio.to_thread(
+                    self.hub.inbox_agent_ids, payload_type=self.request_type
+                )
+                for agent_id in agent_ids:
+                    self._schedule(agent_id)
+            except Exception:
+                logger.exception("A2A sweeper failed")
@@ -0,0 +1,383 @@
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: without numpy, callers fall back to plain SQL ordering
+    np = None
+
+from freigent_db import DB_PATH, db_changed_profile_ids, db_load_profiles, text_terms
+from freigent_real_json import profile_to_text
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileVectorIndex:
+    """
+    In-memory similarity index over profile_to_text() of every profile.
+
+    Each profile becomes a hashed term-frequency vector (signed feature
+    hashing into `dim` buckets, 1 + log tf, L2-normalized) stored as one
+    row of a float32 NumPy matrix. Queries are weighted by IDF per bucket,
+    so terms every profile shares (the profile template, "rating", ...)
+    barely count.
+
+    Small indexes are searched exhaustively. From `ivf_min_size` profiles
+    on, an inverted-file (IVF) structure is trained: k-means centroids
+    split the rows into ~sqrt(n) lists and a query only scores the rows of
+    the `nprobe` lists closest to it (each list also keeps a contiguous copy
+    of its vectors, so memory is ~2x the matrix once trained). The centroids
+    are retrained whenever the index has doubled since the last training.
+
+    Sync: API modules call upsert() right after writing a profile, passing
+    the profile's updated_seq so refresh() doesn't index it again. Writes
+    from other workers (and bulk ingestion) are picked up by refresh(),
+    which follows profiles.updated_seq. Every row remembers the updated_seq
+    of its vector, so a slow refresh never puts an older version back.
+
+    start() loads, refreshes and trains the index in a background thread
+    every `refresh_interval` seconds; until the first load is done,
+    similar() returns [] and callers use their fallback ordering. Without
+    start() (scripts), similar() refreshes and trains inline instead.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        dim: int = 256,
+        ivf_min_size: int = 20000,
+        nprobe: int = 8,
+        refresh_interval: float = 1.0,
+    ) -> None:
+        self.db_path = db_path
+        self.dim = int(dim)
+        self.ivf_min_size = int(ivf_min_size)
+        self.nprobe = int(nprobe)
+        self.refresh_interval = float(refresh_interval)
+
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._seq = -1  # highest profiles.updated_seq applied
+        self._last_refresh = 0.0
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+
+        self._matrix = None  # (capacity, dim) float32
+        self._row_seq = None  # updated_seq of each row's vector (-1: unknown)
+        self._df = None  # documents with a non-zero value per bucket
+
+        # IVF state (None until trained)
+        self._centroids = None
+        self._assign = None  # row -> list id
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, Tuple[Any, Any]] = {}
+        self._trained_size = 0
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    @property
+    def ready(self) -> bool:
+        """True once the background thread has loaded every profile."""
+        return self._ready.is_set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # ------------------------------------------------------------------
+    # Background maintenance
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        """Warm, refresh and (re)train the index in a daemon thread."""
+        if np is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profile-index", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh(force=True)
+                self._ready.set()
+                self._maybe_train()
+            except Exception:
+                logger.exception("profile index: refresh failed")
+            self._stop.wait(self.refresh_interval)
+
+    # ------------------------------------------------------------------
+    # Vectors
+    # ------------------------------------------------------------------
+    def _vectorize(self, text: str) -> Any:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for term, count in text_terms(text).items():
+            h = zlib.crc32(term.encode("utf-8"))
+            sign = -1.0 if h & 0x80000000 else 1.0
+            vec[h % self.dim] += sign * (1.0 + math.log(count))
+        norm = float(np.linalg.norm(vec))
+        if norm:
+            vec /= norm
+        return vec
+
+    def _query_vector(self, text: str) -> Any:
+        vec = self._vectorize(text)
+        n = len(self._ids)
+        idf = np.log1p(n / (1.0 + self._df)).astype(np.float32)
+        vec *= idf
+        norm = float(np.linalg.norm(vec))
+        if norm:
+            vec /= norm
+        return vec
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def upsert(self, user_id: str, profile: Dict[str, Any], seq: Optional[int] = None) -> None:
+        """
+        Index (or re-index) one profile_dict. `seq` is the updated_seq the
+        write got: refresh() then skips this version of the profile, and
+        never replaces it with an older one.
+        """
+        self.upsert_many([(user_id, profile)], None if seq is None else {user_id: seq})
+
+    def upsert_many(
+        self,
+        items: Iterable[Tuple[str, Dict[str, Any]]],
+        seqs: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        Index several profiles. With `seqs` (user_id -> updated_seq of the
+        profile given), a profile whose row already holds that version or a
+        newer one is left alone.
+        """
+        if np is None:
+            return
+        vectors = [(user_id, self._vectorize(profile_to_text(p))) for user_id, p in items]
+        if not vectors:
+            return
+
+        with self._lock:
+            if self._matrix is None:
+                capacity = max(1024, len(vectors))
+                self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+                self._row_seq = np.full(capacity, -1, dtype=np.int64)
+                self._df = np.zeros(self.dim, dtype=np.float64)
+                self._assign = np.zeros(capacity, dtype=np.int32)
+
+            for user_id, vec in vectors:
+                seq = -1 if seqs is None else seqs.get(user_id, -1)
+                row = self._rows.get(user_id)
+                if row is not None and seq >= 0 and self._row_seq[row] >= seq:
+                    continue  # a newer (or the same) version won the race
+                if row is None:
+                    row = len(self._ids)
+                    if row >= len(self._matrix):
+                        self._grow(row + 1)
+                    self._ids.append(user_id)
+                    self._rows[user_id] = row
+                else:
+                    self._df -= self._matrix[row] != 0
+                    if self._centroids is not None:
+                        self._unassign(row)
+
+                self._matrix[row] = vec
+                self._row_seq[row] = max(seq, int(self._row_seq[row]))
+                self._df += vec != 0
+                if self._centroids is not None:
+                    self._assign_row(row)
+
+    def _grow(self, needed: int) -> None:
+        # resized in place (realloc, new rows zeroed) rather than copied into
+        # a new array, so the old and new matrices never coexist. No views of
+        # these arrays outlive the lock (_probe keeps copies), hence refcheck=False.
+        capacity = max(needed, 2 * len(self._matrix))
+        old = len(self._row_seq)
+        self._matrix.resize((capacity, self.dim), refcheck=False)
+        self._assign.resize(capacity, refcheck=False)
+        self._row_seq.resize(capacity, refcheck=False)
+        self._row_seq[old:] = -1
+
+    # ------------------------------------------------------------------
+    # IVF (approximate nearest neighbours)
+    # ------------------------------------------------------------------
+    def _maybe_train(self) -> None:
+        """Train once the index reaches ivf_min_size and whenever it doubles."""
+        n = len(self._ids)
+        if n >= self.ivf_min_size and n >= 2 * self._trained_size:
+            self._train()
+
+    def _train(self, iterations: int = 8, seed: int = 0) -> None:
+        """Spherical k-means over a sample of the rows, then bucket every row."""
+        with self._lock:
+            n = len(self._ids)
+            nlist = max(1, int(math.sqrt(n)))
+            rng = np.random.default_rng(seed)
+            # fancy indexing copies: k-means runs without holding the lock
+            sample = self._matrix[rng.choice(n, size=min(n, 64 * nlist), replace=False)]
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        with self._lock:
+            # rows written meanwhile are bucketed too
+            n = len(self._ids)
+            self._centroids = centroids
+            self._lists = [[] for _ in range(nlist)]
+            self._list_arrays = {}
+            for start in range(0, n, 65536):
+                block = self._matrix[start : min(n, start + 65536)]
+                labels = np.argmax(block @ centroids.T, axis=1)
+                self._assign[start : start + len(block)] = labels
+                for offset, label in enumerate(labels.tolist()):
+                    self._lists[label].append(start + offset)
+            self._trained_size = n
+        logger.info("profile index: trained %d IVF lists over %d profiles", nlist, n)
+
+    def _assign_row(self, row: int) -> None:
+        label = int(np.argmax(self._centroids @ self._matrix[row]))
+        self._assign[row] = label
+        self._lists[label].append(row)
+        self._list_arrays.pop(label, None)
+
+    def _unassign(self, row: int) -> None:
+        label = int(self._assign[row])
+        self._lists[label].remove(row)
+        self._list_arrays.pop(label, None)
+
+    def _probe(self, q: Any) -> List[Tuple[Any, Any]]:
+        """
+        (row ids, vectors) of the `nprobe` lists closest to q. Each list's
+        vectors are kept as one contiguous copy (rebuilt after the list
+        changes): scoring a contiguous block is ~10x faster than gathering
+        scattered rows out of the main matrix.
+        """
+        nprobe = min(self.nprobe, len(self._centroids))
+        probe = np.argpartition(-(self._centroids @ q), nprobe - 1)[:nprobe]
+        blocks = []
+        for label in probe.tolist():
+            block = self._list_arrays.get(label)
+            if block is None:
+                rows = np.asarray(self._lists[label], dtype=np.int64)
+                block = self._list_arrays[label] = (rows, self._matrix[rows])
+            blocks.append(block)
+        return blocks
+
+    # ------------------------------------------------------------------
+    # Sync with the DB
+    # ------------------------------------------------------------------
+    def refresh(self, force: bool = False) -> int:
+        """
+        Index profiles written since the last refresh (by any process),
+        except versions this process already indexed through upsert().
+        The first call loads every profile. Returns how many were indexed.
+        """
+        if np is None:
+            return 0
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return 0
+        self._last_refresh = now
+
+        changed = db_changed_profile_ids(self._seq, db_path=self.db_path)
+        if not changed:
+            return 0
+
+        with self._lock:
+            seqs = {
+                user_id: seq
+                for user_id, seq in changed
+                if user_id not in self._rows or self._row_seq[self._rows[user_id]] < seq
+            }
+        profiles = db_load_profiles(list(seqs), db_path=self.db_path) if seqs else {}
+        # an upsert() of a newer version may land while we load: upsert_many
+        # re-checks each row's seq under the lock
+        self.upsert_many(profiles.items(), seqs)
+        with self._lock:
+            self._seq = max(self._seq, changed[-1][1])
+        return len(profiles)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def similar(
+        self,
+        profile: Dict[str, Any],
+        k: int,
+        exclude: Sequence[str] = (),
+        extra_text: str = "",
+    ) -> List[Tuple[str, float]]:
+        """
+        Top-k [(user_id, score)] most similar to `profile` (plus optional
+        extra_text such as a search query), best first. Only positive
+        scores are returned, so the result may be shorter than k.
+        """
+        if np is None or k <= 0:
+            return []
+        if self._thread is None:
+            self.refresh()
+            self._maybe_train()
+        elif not self.ready:
+            return []  # still warming up in the background: callers fall back
+
+        with self._lock:
+            n = len(self._ids)
+            if not n:
+                return []
+            q = self._query_vector(profile_to_text(profile) + "\n" + extra_text)
+
+            if self._centroids is None:
+                rows = None
+                scores = self._matrix[:n] @ q
+            else:
+                blocks = self._probe(q)
+                rows = np.concatenate([r for r, _ in blocks])
+                scores = np.concatenate([vectors @ q for _, vectors in blocks])
+            if not len(scores):
+                return []
+
+            want = min(len(scores), k + len(exclude))
+            top = np.argpartition(-scores, want - 1)[:want]
+            top = top[np.argsort(-scores[top])]
+
+            excluded = set(exclude)
+            result: List[Tuple[str, float]] = []
+            for i in top.tolist():
+                score = float(scores[i])
+                if score <= 0:
+                    break
+                user_id = self._ids[i if rows is None else int(rows[i])]
+                if user_id in excluded:
+                    continue
+                result.append((user_id, score))
+                if len(result) >= k:
+                    break
+            return result
+
+
+PROFILE_INDEX = ProfileVectorIndex(
+    dim=int(os.getenv("FREIGENT_INDEX_DIM", "256")),
+    ivf_min_size=int(os.getenv("FREIGENT_INDEX_IVF_MIN_SIZE", "20000")),
+    nprobe=int(os.getenv("FREIGENT_INDEX_NPROBE", "8")),
+    refresh_interval=float(os.getenv("FREIGENT_INDEX_REFRESH_SECONDS", "1.0")),
+)